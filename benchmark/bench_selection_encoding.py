@@ -0,0 +1,73 @@
+""" Compare encodings of t-SNE selections sent to the t-sne-selection process
+
+For several numbers of points and selection shapes the script reports
+the size of the input payload and the time needed to encode and decode
+it, for the JSON list of indices used before and for the compact
+encodings from `orangecontrib.resolwe.utils.selection`.
+
+    python benchmark/bench_selection_encoding.py --points 10000 100000 1000000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from orangecontrib.resolwe.utils.selection import (
+    decode_selection, encode_bitset, encode_rle, encode_selection, selection_mask
+)
+
+
+def selections(n, rng):
+    # a lasso over a region of sorted points, and scattered points of a cluster
+    yield 'block 30%', np.arange(int(n * 0.3), int(n * 0.6))
+    yield 'blocks 10x3%', np.concatenate([np.arange(start, start + n // 33)
+                                          for start in range(0, n, n // 10)])
+    yield 'random 5%', np.sort(rng.choice(n, n // 20, replace=False))
+    yield 'random 50%', np.sort(rng.choice(n, n // 2, replace=False))
+    yield 'all', np.arange(n)
+
+
+def timed(func, *args, repeat=3):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench(n, rng):
+    encoders = [
+        ('json', lambda indices: json.dumps(indices.tolist())),
+        ('rle', lambda indices: encode_rle(selection_mask(indices, n))),
+        ('bitset', lambda indices: encode_bitset(selection_mask(indices, n))),
+        ('chosen', lambda indices: encode_selection(indices, n)),
+    ]
+    decoders = {'json': lambda encoded: np.array(json.loads(encoded))}
+
+    for name, indices in selections(n, rng):
+        print('{} points, {} ({} selected)'.format(n, name, len(indices)))
+        for encoding, encode in encoders:
+            encode_time, encoded = timed(encode, indices)
+            decode_time, decoded = timed(decoders.get(encoding, decode_selection), encoded)
+            assert np.array_equal(decoded, indices)
+            print('  {:<8}{:>12} B{:>11.2f} ms{:>11.2f} ms'.format(
+                encoding, len(encoded), encode_time * 1000, decode_time * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='numbers of points in the embedding')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    print('  {:<8}{:>14}{:>14}{:>14}'.format('encoding', 'size', 'encode', 'decode'))
+    for n in args.points:
+        bench(n, rng)
+
+
+if __name__ == '__main__':
+    main()
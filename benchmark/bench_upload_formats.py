@@ -0,0 +1,77 @@
+""" Compare transfer formats of upload_data_table on single cell datasets
+
+Every dataset from `upload_sc_datasets.SC_FILES` is saved in each of the
+transfer formats. The script reports the time needed to write the file,
+its size and compression ratio, and the estimated upload time at the
+given bandwidth. With --upload the file is also uploaded to the server
+configured by the RESOLWE_* environment variables and the actual upload
+time is reported.
+
+    python benchmark/bench_upload_formats.py --bandwidth 10 aml-1k.pickle
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from Orange.data import Table
+
+from orangecontrib.resolwe.utils import ResolweHelper
+from orangecontrib.resolwe.utils.transfer import (
+    FORMATS, choose_format, save_table, sparsify
+)
+from orangecontrib.resolwe.utils.upload_sc_datasets import URL_REMOTE, SC_FILES
+
+
+def bench_table(table, bandwidth, res=None):
+    rows = []
+    for transfer_format in FORMATS:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            start = time.perf_counter()
+            file_path = save_table(table, temp_dir, transfer_format)
+            save_time = time.perf_counter() - start
+            size = os.path.getsize(file_path)
+
+            upload_time = None
+            if res is not None:
+                start = time.perf_counter()
+                res.res.run('data-table-upload', input={'src': file_path})
+                upload_time = time.perf_counter() - start
+
+        rows.append((transfer_format, save_time, size, upload_time))
+
+    raw_size = next(size for transfer_format, _, size, _ in rows if transfer_format == 'pickle')
+    chosen = choose_format(table, compress=True)
+    for transfer_format, save_time, size, upload_time in rows:
+        transfer_time = save_time + size / (bandwidth * 1024 ** 2)
+        print('  {:<10}{:>9.2f} s{:>10.1f} MB{:>8.1f}x{:>9.2f} s{:>12}{}'.format(
+            transfer_format, save_time, size / 1024 ** 2, raw_size / size, transfer_time,
+            '{:.2f} s'.format(upload_time) if upload_time is not None else '-',
+            '  <- chosen' if transfer_format == chosen else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help='dataset file names (default: all SC_FILES)')
+    parser.add_argument('--bandwidth', type=float, default=10,
+                        help='upload bandwidth in MB/s used for estimates')
+    parser.add_argument('--upload', action='store_true', help='also upload to the server')
+    parser.add_argument('--dense', action='store_true', help='do not convert X to sparse')
+    args = parser.parse_args()
+
+    res = ResolweHelper() if args.upload else None
+    files = args.files or [file_name for file_name, _ in SC_FILES]
+
+    print('  {:<10}{:>11}{:>13}{:>9}{:>11}{:>12}'.format(
+        'format', 'save', 'size', 'ratio', 'estimate', 'upload'))
+    for file_name in files:
+        table = Table(os.path.join(URL_REMOTE, file_name))
+        if not args.dense:
+            table = sparsify(table)
+        print('{} ({} x {}, {})'.format(file_name, len(table), len(table.domain.attributes),
+                                        'sparse' if table.is_sparse() else 'dense'))
+        bench_table(table, args.bandwidth, res)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import unittest
+
+from types import SimpleNamespace
+
+import numpy as np
+import scipy.sparse as sp
+
+from Orange.data import ContinuousVariable, Domain, Table
+
+from orangecontrib.resolwe.utils.cache import DataListing, TableCache
+
+
+def table(X):
+    domain = Domain([ContinuousVariable('x{}'.format(i)) for i in range(X.shape[1])],
+                    ContinuousVariable('y'))
+    data = Table.from_numpy(domain, X, np.arange(X.shape[0], dtype=float))
+    data.name = 'data'
+    return data
+
+
+def data_object(data_id, modified='2018-01-01', created=None, **tabular):
+    return SimpleNamespace(id=data_id, name='file{}.pickle'.format(data_id), modified=modified,
+                           created=created or modified, descriptor={'tabular': tabular},
+                           output={'table': {'file': 'file.pickle', 'size': 100}})
+
+
+class TableCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = TableCache(self.directory)
+
+    def assertTablesEqual(self, first, second):
+        X = first.X.toarray() if sp.issparse(first.X) else first.X
+        np.testing.assert_array_equal(X, second.X.toarray() if sp.issparse(second.X) else second.X)
+        np.testing.assert_array_equal(first.Y, second.Y)
+        self.assertEqual(first.name, second.name)
+
+    def test_key(self):
+        obj = data_object(1)
+        key = TableCache.key('http://server/', obj)
+        self.assertEqual(key, TableCache.key('http://server/', data_object(1)))
+        self.assertNotEqual(key, TableCache.key('http://other/', obj))
+        self.assertNotEqual(key, TableCache.key('http://server/', data_object(1, '2018-02-01')))
+
+    def test_pickle(self):
+        data = table(np.random.rand(10, 3))
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.put('key', data)
+        self.assertIn('key', self.cache)
+
+        cached = self.cache.get('key')
+        self.assertTablesEqual(cached, data)
+        self.assertTrue(cached.X.flags.writeable)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_mmap(self):
+        for X in (np.random.rand(10, 3), sp.random(10, 30, density=0.1, format='csr')):
+            data = table(X)
+            self.cache.put('key', data, mmap=True)
+            cached = self.cache.get('key', mmap=True)
+            self.assertTablesEqual(cached, data)
+            self.assertFalse(cached.Y.flags.writeable)
+
+    def test_modes_separate(self):
+        self.cache.put('key', table(np.random.rand(10, 3)), mmap=True)
+        # a pickled table was requested, the memory-mapped one is not returned
+        self.assertIsNone(self.cache.get('key'))
+        self.assertIsNotNone(self.cache.get('key', mmap=True))
+        self.assertIsNotNone(self.cache.read('key', mmap=True))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_corrupted(self):
+        self.cache.put('key', table(np.random.rand(10, 3)))
+        with open(self.cache.path('key'), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_evict(self):
+        data = table(np.random.rand(100, 10))
+        self.cache.put('old', data)
+        size = os.path.getsize(self.cache.path('old'))
+        os.utime(self.cache.path('old'), (0, 0))
+
+        self.cache.max_size = int(size * 1.5)
+        self.cache.put('new', data)
+        self.assertNotIn('old', self.cache)
+        self.assertIn('new', self.cache)
+
+        self.cache.clear()
+        self.assertNotIn('new', self.cache)
+
+
+class DataListingTest(unittest.TestCase):
+    schema = SimpleNamespace(slug='data_info', schema=[
+        {'name': 'tabular', 'group': [{'name': 'title'}, {'name': 'file_name'}]}])
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'listing.json')
+        self.listing = DataListing(self.path)
+        self.listing.set_descriptor_schema(self.schema)
+        self.listing.merge([], 3)
+
+    def test_pages(self):
+        self.listing.add_page(0, [data_object(1, title='a'), data_object(2, title='b')], False)
+        # not a continuation
+        self.listing.add_page(1, [data_object(5)], False)
+        self.assertEqual([row.id for row in self.listing.rows()], [1, 2])
+        self.assertEqual(self.listing.rows()[0].values, ['a', 'file1.pickle'])
+        self.assertFalse(self.listing.complete)
+
+        self.listing.add_page(2, [data_object(3, '2018-01-05')], True)
+        self.assertTrue(self.listing.complete)
+        self.assertEqual(self.listing.modified, '2018-01-05')
+
+    def test_merge(self):
+        self.listing.add_page(0, [data_object(1), data_object(2)], False)
+        # changed listed object, a new and a changed object beyond the listed rows
+        self.assertTrue(self.listing.merge([
+            data_object(2, '2018-01-03', created='2018-01-01', title='changed'),
+            data_object(7, '2018-01-04'),
+            data_object(5, '2018-01-02', created='2018-01-01')], 4))
+        self.assertEqual([row.id for row in self.listing.rows()], [1, 2])
+        self.assertEqual(self.listing.rows()[1].values[0], 'changed')
+        self.assertEqual(self.listing.modified, '2018-01-04')
+
+        # one object deleted
+        self.assertFalse(self.listing.merge([], 3))
+
+    def test_merge_complete(self):
+        self.listing.add_page(0, [data_object(1), data_object(2), data_object(3)], True)
+        self.assertTrue(self.listing.merge([data_object(4, '2018-01-02')], 4))
+        self.assertEqual(len(self.listing), 4)
+        self.assertFalse(self.listing.merge([], 3))
+
+    def test_schema_change(self):
+        self.listing.add_page(0, [data_object(1)], False)
+        self.listing.set_descriptor_schema(self.schema)
+        self.assertEqual(len(self.listing), 1)
+
+        self.listing.set_descriptor_schema(SimpleNamespace(slug='data_info', schema=[]))
+        self.assertEqual(len(self.listing), 0)
+
+    def test_save_load(self):
+        self.listing.add_page(0, [data_object(1, title='a'), data_object(2)], True)
+        self.listing.save()
+
+        loaded = DataListing(self.path)
+        self.assertEqual(loaded.rows(), self.listing.rows())
+        self.assertEqual(loaded.descriptor_schema, self.listing.descriptor_schema)
+        self.assertEqual((loaded.count, loaded.modified, loaded.complete), (3, '2018-01-01', True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import tempfile
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from orangecontrib.resolwe.tests.test_cache import data_object, table
+from orangecontrib.resolwe.tests.test_scheduler import DataObject, Server
+from orangecontrib.resolwe.utils import (
+    DEFAULT_TIMEOUT, PROCESS_TIMEOUTS, ProcessTimeout, ResolweHelper
+)
+from orangecontrib.resolwe.utils.cache import TableCache
+from orangecontrib.resolwe.utils.scheduler import StatusScheduler
+
+
+class Process(DataObject):
+    process_name = 't-sne'
+
+
+class TimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.helper = ResolweHelper()
+        scheduler = mock.patch.object(ResolweHelper, 'scheduler', new_callable=mock.PropertyMock,
+                                      return_value=StatusScheduler(self.server))
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+
+    def test_timeouts(self):
+        self.assertEqual(self.helper.get_timeout('t-sne'), PROCESS_TIMEOUTS['t-sne'])
+        self.assertEqual(self.helper.get_timeout('data-table-upload'), DEFAULT_TIMEOUT)
+
+        self.helper.set_timeout('t-sne', None)
+        self.assertIsNone(self.helper.get_timeout('t-sne'))
+        # settings of one helper do not leak into others
+        self.assertEqual(ResolweHelper().get_timeout('t-sne'), PROCESS_TIMEOUTS['t-sne'])
+
+    def test_run_process_timeout(self):
+        self.server.statuses[1] = 'PR'
+        self.helper.set_timeout('t-sne', 0.1)
+        with mock.patch.object(self.helper, 'start_process', return_value=Process(1)):
+            with self.assertRaises(ProcessTimeout) as context:
+                self.helper.run_process('t-sne')
+        # the job keeps running on the server and can be resumed
+        self.assertEqual(context.exception.data_object.id, 1)
+
+    def test_resume_process(self):
+        self.server.statuses[1] = 'PR'
+        self.helper.set_timeout('t-sne', 0.1)
+        with mock.patch.object(self.helper, 'get_object', return_value=Process(1)):
+            process = self.helper.resume_process(1, 't-sne')
+        # unfinished objects are returned, not raised
+        self.assertEqual(process.status, 'PR')
+
+        self.server.statuses[1] = 'OK'
+        with mock.patch.object(self.helper, 'get_object', return_value=Process(1)):
+            process = self.helper.resume_process(1, 't-sne')
+        self.assertEqual(process.status, 'OK')
+
+
+class CachedTableTest(unittest.TestCase):
+    def setUp(self):
+        self.helper = ResolweHelper()
+        self.cache = TableCache(tempfile.mkdtemp())
+        cache = mock.patch.object(ResolweHelper, 'cache', new_callable=mock.PropertyMock,
+                                  return_value=self.cache)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+        self.data_object = data_object(1)
+        self.data_object.update = lambda: None
+        self.table = table(np.arange(6, dtype=float).reshape(3, 2))
+
+    def test_cached_data_table(self):
+        with mock.patch.object(self.helper, '_fetch_data_table') as fetch:
+            self.assertIsNone(self.helper.cached_data_table(self.data_object))
+
+            key = self.cache.key(self.helper.url, self.data_object)
+            for mmap in (False, True):
+                self.cache.put(key, self.table, mmap=mmap)
+                cached = self.helper.cached_data_table(self.data_object)
+                np.testing.assert_array_equal(cached.X, self.table.X)
+                self.cache.clear()
+        # never downloaded
+        fetch.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from orangecontrib.resolwe.tests.test_scheduler import DataObject, Server
+from orangecontrib.resolwe.utils import scheduler
+from orangecontrib.resolwe.utils.scheduler import MAX_INTERVAL, StatusScheduler
+
+try:
+    from websockets.sync.server import serve
+except ImportError:
+    serve = None
+
+
+@unittest.skipIf(serve is None or scheduler.websocket is None,
+                 'websockets and websocket-client are required')
+class NotificationChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self.connected = threading.Event()
+        self.ws_server = serve(self.handler, 'localhost', 0)
+        threading.Thread(target=self.ws_server.serve_forever, daemon=True).start()
+        self.url = 'ws://localhost:{}/ws'.format(self.ws_server.socket.getsockname()[1])
+
+        self.res = Server()
+        self.scheduler = StatusScheduler(self.res)
+
+    def tearDown(self):
+        if self.scheduler.channel is not None:
+            self.scheduler.channel.close()
+        self.ws_server.shutdown()
+
+    def handler(self, connection):
+        self.connections.append(connection)
+        self.connected.set()
+        for _ in connection:
+            pass
+
+    def notify(self, data_id):
+        for connection in self.connections:
+            connection.send(json.dumps({'item': {'id': data_id}}))
+
+    def connect(self):
+        thread = self.scheduler.connect_notifications(self.url)
+        self.assertIsNotNone(thread)
+        thread.join(5)
+        self.assertTrue(self.scheduler.connected)
+
+    def test_connect_in_background(self):
+        start = time.perf_counter()
+        thread = self.scheduler.connect_notifications(self.url)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        # a second call while connecting does not start another attempt
+        self.assertIsNone(self.scheduler.connect_notifications(self.url))
+
+        thread.join(5)
+        self.assertTrue(self.connected.wait(5))
+        self.assertTrue(self.scheduler.connected)
+        path = self.connections[0].request.path
+        self.assertEqual(path, '/ws/' + self.scheduler.channel.subscriber_id)
+
+    def test_unreachable_server(self):
+        self.ws_server.shutdown()
+        self.scheduler.connect_notifications(self.url).join(5)
+        self.assertFalse(self.scheduler.connected)
+        # no new attempt until the reconnect delay passes
+        self.assertIsNone(self.scheduler.connect_notifications(self.url))
+        self.scheduler._reconnect_at = 0
+        self.assertIsNotNone(self.scheduler.connect_notifications(self.url))
+
+    def test_observe_before_poll(self):
+        self.connect()
+        self.res.statuses[1] = 'PR'
+        data_object = DataObject(1)
+
+        self.assertFalse(self.scheduler.wait(data_object, timeout=0.1))
+        self.assertEqual(self.res.calls[0], ('observe', [1]))
+        self.assertIn(('poll', [1]), self.res.calls)
+
+    def test_notification_wakes_poller(self):
+        self.connect()
+        self.res.statuses[1] = 'PR'
+        data_object = DataObject(1)
+
+        def finish():
+            # after the first round, polling falls back to the maximal interval
+            while ('poll', [1]) not in self.res.calls:
+                time.sleep(0.01)
+            self.res.statuses[1] = 'OK'
+            self.notify(1)
+
+        threading.Thread(target=finish, daemon=True).start()
+        start = time.perf_counter()
+        self.assertTrue(self.scheduler.wait(data_object, timeout=MAX_INTERVAL * 2))
+        self.assertLess(time.perf_counter() - start, MAX_INTERVAL / 2)
+        self.assertEqual(data_object.status, 'OK')
+
+
+class DisabledChannelTest(unittest.TestCase):
+    def test_missing_websocket_client(self):
+        scheduler_ = StatusScheduler(Server())
+        with mock.patch.object(scheduler, 'websocket', None), \
+                self.assertLogs(scheduler.log, 'WARNING') as logs:
+            self.assertIsNone(scheduler_.connect_notifications('ws://localhost/ws'))
+            self.assertIsNone(scheduler_.connect_notifications('ws://localhost/ws'))
+        # reported once, not on every access of the scheduler
+        self.assertEqual(len(logs.output), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+from unittest import mock
+
+from AnyQt.QtWidgets import QCheckBox
+from resdk import resolwe
+
+from Orange.data import Table
+from Orange.widgets.tests.base import WidgetTest
+
+from orangecontrib.resolwe.widgets.owresolwedataobject import OWResolweDataObject
+
+
+def data_object(data_id=1):
+    obj = mock.Mock(spec=resolwe.Data)
+    obj.id = data_id
+    obj.current_user_permissions = []
+    return obj
+
+
+class TestOWResolweDataObject(WidgetTest):
+    def setUp(self):
+        self.widget = self.create_widget(OWResolweDataObject)
+        self.table = Table('iris')
+        self.downloads = []
+
+    def download(self, data_table_object, progress_callback=None, mmap=False, cancelled=None):
+        # called in the worker thread, like the streamed download
+        self.downloads.append(mmap)
+        progress_callback(50.)
+        return self.table
+
+    def test_download_progress(self):
+        widget = self.widget
+        with mock.patch.object(widget.res, 'download_data_table', self.download), \
+                mock.patch.object(widget, 'progressBarSet') as progress_bar_set:
+            self.send_signal(widget.Inputs.data, data_object())
+            output = self.process_events(lambda: self.get_output(widget.Outputs.data))
+
+        self.assertIs(output, self.table)
+        progress_bar_set.assert_any_call(50.)
+        self.assertIsNone(widget._task)
+
+    def test_memory_map_reloads(self):
+        widget = self.widget
+        with mock.patch.object(widget.res, 'download_data_table', self.download):
+            self.send_signal(widget.Inputs.data, data_object())
+            self.process_events(lambda: widget._task is None)
+            checkbox, = [box for box in widget.findChildren(QCheckBox)
+                         if box.text() == 'Memory-map cached table']
+            checkbox.click()
+            self.process_events(lambda: widget._task is None and len(self.downloads) == 2)
+        self.assertEqual(self.downloads, [False, True])
@@ -0,0 +1,33 @@
+import threading
+
+from unittest import mock
+
+from Orange.widgets.tests.base import WidgetTest
+
+from orangecontrib.resolwe.widgets.owresolwedatasets import OWResolweDataSets
+
+
+class TestOWResolweDataSets(WidgetTest):
+    def setUp(self):
+        # the listing is not refreshed from the server
+        with mock.patch.object(OWResolweDataSets, 'run_refresh'):
+            self.widget = self.create_widget(OWResolweDataSets)
+        self.prefetched = []
+
+    def prefetch_data_table(self, data_id, cancelled=None, bytes_callback=None):
+        self.prefetched.append(data_id)
+        if bytes_callback is not None:
+            # tables are larger than listed
+            bytes_callback(70)
+        return True
+
+    def test_prefetch_budget_per_selection(self):
+        neighbours = [(2, 50), (3, 50)]
+        with mock.patch.object(self.widget.res, 'prefetch_data_table', self.prefetch_data_table):
+            self.widget._prefetch_tables(1, neighbours, 100, threading.Event())
+            self.assertEqual(self.prefetched, [1, 2])
+
+            # a new selection has the whole budget again
+            self.prefetched = []
+            self.widget._prefetch_tables(4, neighbours, 100, threading.Event())
+            self.assertEqual(self.prefetched, [4, 2])
@@ -0,0 +1,124 @@
+import threading
+
+from concurrent.futures import Future
+from unittest import mock
+
+import numpy as np
+
+from AnyQt.QtCore import QPointF, QRectF
+
+from Orange.widgets.tests.base import WidgetTest
+
+from orangecontrib.resolwe.utils import ResolweTask
+from orangecontrib.resolwe.utils.embedding import LocalEmbedding
+from orangecontrib.resolwe.widgets.owresolwetsne import OWResolwetSNE
+
+
+class Process:
+    def __init__(self, data_id=1, status='PR', process_progress=0, output=None):
+        self.id = data_id
+        self.status = status
+        self.process_progress = process_progress
+        self.output = output or {}
+
+
+class TestOWResolwetSNE(WidgetTest):
+    def setUp(self):
+        self.widget = self.create_widget(OWResolwetSNE)
+
+    def test_progress(self):
+        widget = self.widget
+        on_update = widget._embedding_watcher(snapshots=False)
+        with mock.patch.object(widget, 'progressBarSet') as progress_bar_set:
+            # reported from the worker thread that waits for the process
+            thread = threading.Thread(target=on_update, args=(Process(process_progress=40),))
+            thread.start()
+            thread.join()
+            self.process_events(lambda: progress_bar_set.called)
+        progress_bar_set.assert_called_with(40.)
+
+    def test_sweep(self):
+        widget = self.widget
+        widget.local_selection = False
+        widget.data_table_object = Process(data_id=7, status='OK')
+        runs = [((7, 20, perplexity, 300), {'data_table': widget.data_table_object,
+                                           'pca_components': 20,
+                                           'perplexity': perplexity,
+                                           'iterations': 300})
+                for perplexity in (10, 30)]
+        embedding = np.zeros((5, 2), dtype=np.float32)
+        widget.res = mock.Mock()
+        widget.res.process_inputs.return_value = {'data_table', 'perplexity', 'iterations'}
+        widget.res.start_process.side_effect = lambda slug, **inputs: Process(status='OK')
+        widget.res.get_timeout.return_value = 60
+        with mock.patch.object(widget, '_fetch_embedding', return_value=(embedding, None)), \
+                mock.patch.object(widget, 'progressBarSet') as progress_bar_set:
+            # runs in the worker thread, results are added in the main thread
+            thread = threading.Thread(target=widget._sweep, args=(runs, threading.Event()))
+            thread.start()
+            thread.join()
+            self.process_events(lambda: len(widget._results) == 2)
+            self.process_events(lambda: progress_bar_set.call_count == 2)
+        self.assertEqual(sorted(widget._results), [key for key, _ in runs])
+        progress_bar_set.assert_called_with(100.)
+        self.assertEqual(widget.res.wait_process.call_count, 2)
+
+    def test_new_data_is_not_warm_started(self):
+        widget = self.widget
+        widget._embedding_data_object = Process(data_id=3, status='OK')
+        widget._embedding = np.zeros((5, 2), dtype=np.float32)
+        with mock.patch.object(widget, '_run_embeding') as run_embeding:
+            widget.set_data(Process(data_id=7, status='OK'))
+        self.assertIsNone(widget._embedding)
+        self.assertIsNone(widget._embedding_data_object)
+        run_embeding.assert_called_once_with()
+
+    def test_local_result_is_cached(self):
+        widget = self.widget
+        widget.local_selection = False
+        widget.data_table_object = Process(data_id=7, status='OK')
+        task = ResolweTask(widget._tsne_slug)
+        task.key = widget._embedding_key()
+        # requested, but the local backend does not start from `init`
+        task.warm_start = True
+        task.future = Future()
+        task.future.set_result(LocalEmbedding(np.zeros((5, 2), dtype=np.float32), None, None))
+        widget._task = task
+        widget.task_finished(task.future)
+        self.assertIn(task.key, widget._results)
+
+    def show_embedding(self, n):
+        widget = self.widget
+        rng = np.random.RandomState(0)
+        widget._embedding = rng.uniform(-10, 10, (n, 2)).astype(np.float32)
+        widget._setup_plot()
+        return widget.graph
+
+    def test_select_by_rectangle(self):
+        graph = self.show_embedding(1000)
+        with mock.patch.object(self.widget, 'commit'):
+            graph.select_by_rectangle(QRectF(QPointF(-5, -5), QPointF(0, 0)))
+        x, y = self.widget._embedding.T
+        expected = np.flatnonzero((x >= -5) & (x <= 0) & (y >= -5) & (y <= 0))
+        np.testing.assert_array_equal(graph.get_selection(), expected)
+
+    def test_select_at(self):
+        graph = self.show_embedding(1000)
+        x, y = self.widget._embedding[10]
+        with mock.patch.object(self.widget, 'commit'):
+            graph.select_at(QPointF(x, y))
+            self.assertIn(10, graph.get_selection())
+            # far from all points
+            graph.select_at(QPointF(100, 100))
+            self.assertEqual(len(graph.get_selection()), 0)
+
+    def test_lod_hides_selection_outlines(self):
+        graph = self.show_embedding(1000)
+        graph.lod_threshold = 100
+        graph.update_lod()
+        # too many points in view, both scatter plots are replaced by the density image
+        self.assertFalse(graph.scatterplot_item.isVisible())
+        self.assertFalse(graph.scatterplot_item_sel.isVisible())
+        # hidden points are not hit
+        x, y = self.widget._embedding[10]
+        self.assertEqual(len(graph.points_at(QPointF(x, y))), 0)
@@ -0,0 +1,173 @@
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from orangecontrib.resolwe.utils.scheduler import (
+    BACKOFF, MAX_INTERVAL, MIN_INTERVAL, StatusScheduler
+)
+
+
+class DataObject:
+    def __init__(self, data_id, status='PR', modified=0):
+        self.id = data_id
+        self.status = status
+        self.modified = modified
+
+    @property
+    def _original_values(self):
+        return {'id': self.id, 'status': self.status, 'modified': self.modified}
+
+    def _update_fields(self, payload):
+        self.status = payload['status']
+        self.modified = payload['modified']
+
+
+class Server:
+    """ Resolwe API stand-in, recording list and observe requests. """
+
+    def __init__(self):
+        self.statuses = {}
+        self.modified = {}
+        self.calls = []
+        self.data = self
+        self.api = self
+
+    def filter(self, id__in):
+        data_ids = [int(data_id) for data_id in id__in.split(',')]
+        self.calls.append(('poll', data_ids))
+        return [DataObject(data_id, self.statuses[data_id], self.modified.get(data_id, 0))
+                for data_id in data_ids]
+
+    def get(self, id__in, observe):
+        self.calls.append(('observe', [int(data_id) for data_id in id__in.split(',')]))
+
+
+class StatusSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.res = Server()
+        self.scheduler = StatusScheduler(self.res)
+
+    def test_single_query(self):
+        self.res.statuses.update({1: 'PR', 2: 'PR'})
+        first, second = DataObject(1), DataObject(2)
+        done = []
+
+        def wait(data_object):
+            done.append(self.scheduler.wait(data_object, timeout=5))
+
+        threads = [threading.Thread(target=wait, args=(obj,)) for obj in (first, second)]
+        for thread in threads:
+            thread.start()
+        while not any(data_ids == [1, 2] for _, data_ids in self.res.calls):
+            time.sleep(0.01)
+
+        self.res.statuses.update({1: 'OK', 2: 'ER'})
+        self.scheduler.wake()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(done, [True, True])
+        self.assertEqual((first.status, second.status), ('OK', 'ER'))
+        # both objects are checked by the same request in every round
+        self.assertTrue(all(data_ids == [1, 2] for _, data_ids in self.res.calls[1:]))
+
+    def test_shared_waiter(self):
+        self.res.statuses[1] = 'PR'
+        done = []
+        threads = [threading.Thread(target=lambda: done.append(
+            self.scheduler.wait(DataObject(1), timeout=5))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while not self.res.calls:
+            time.sleep(0.01)
+        self.assertEqual(len(self.scheduler._waiters), 1)
+
+        self.res.statuses[1] = 'OK'
+        self.scheduler.wake()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(done, [True] * 3)
+
+    def test_interval(self):
+        intervals = [self.scheduler._next_interval() for _ in range(20)]
+        self.assertLessEqual(intervals[0], MIN_INTERVAL * 1.25)
+        self.assertGreater(intervals[3], MIN_INTERVAL * BACKOFF ** 3 * 0.75)
+        self.assertTrue(all(interval <= MAX_INTERVAL * 1.25 for interval in intervals))
+
+        # reset by a new waiter
+        self.res.statuses[1] = 'OK'
+        self.scheduler.wait(DataObject(1, 'PR'), timeout=5)
+        self.assertLessEqual(self.scheduler._interval, MIN_INTERVAL * BACKOFF)
+
+    def test_finished(self):
+        # finished objects are not polled at all
+        self.assertTrue(self.scheduler.wait(DataObject(1, 'OK')))
+        self.assertFalse(self.res.calls)
+
+    def test_on_update(self):
+        self.res.statuses[1] = 'PR'
+        data_object = DataObject(1)
+        updates = []
+
+        def on_update(obj):
+            self.assertIs(obj, data_object)
+            updates.append(obj.modified)
+            if obj.modified == 2:
+                self.res.statuses[1] = 'OK'
+            else:
+                self.res.modified[1] = 2
+            self.scheduler.wake()
+
+        self.res.modified[1] = 1
+        self.assertTrue(self.scheduler.wait(data_object, timeout=5, on_update=on_update))
+        # reported once per change, not once per polling round
+        self.assertEqual(updates, [1, 2])
+        self.assertEqual(data_object.status, 'OK')
+
+    def test_failed_update(self):
+        self.res.statuses[1] = 'PR'
+        data_object = DataObject(1)
+        updates = []
+
+        def on_update(obj):
+            updates.append(obj.modified)
+            if obj.modified == 1:
+                self.res.modified[1] = 2
+                self.scheduler.wake()
+                raise OSError('snapshot download failed')
+            self.res.statuses[1] = 'OK'
+            self.scheduler.wake()
+
+        self.res.modified[1] = 1
+        with self.assertLogs('orangecontrib.resolwe.utils.scheduler', 'ERROR'):
+            self.assertTrue(self.scheduler.wait(data_object, timeout=5, on_update=on_update))
+        # waiting goes on after a failed update
+        self.assertEqual(updates, [1, 2])
+
+    def test_waiter_released(self):
+        self.res.statuses[1] = 'PR'
+        self.res.modified[1] = 1
+
+        with mock.patch.object(self.scheduler, '_changed') as changed:
+            changed.wait.side_effect = KeyboardInterrupt
+            with self.assertRaises(KeyboardInterrupt):
+                self.scheduler.wait(DataObject(1), timeout=5)
+        # not polled after the waiting thread is gone
+        self.assertFalse(self.scheduler._waiters)
+
+    def test_cancelled(self):
+        self.res.statuses[1] = 'PR'
+        cancelled = threading.Event()
+        threading.Timer(0.2, cancelled.set).start()
+
+        start = time.perf_counter()
+        self.assertFalse(self.scheduler.wait(DataObject(1), timeout=10, cancelled=cancelled))
+        self.assertLess(time.perf_counter() - start, 2)
+        # unregistered, polling stops
+        self.assertFalse(self.scheduler._waiters)
+
+
+if __name__ == '__main__':
+    unittest.main()
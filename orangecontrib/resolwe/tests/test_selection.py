@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.resolwe.utils.selection import (
+    BITSET, RLE, decode_selection, encode_bitset, encode_rle, encode_selection,
+    run_lengths, selection_mask
+)
+
+
+class SelectionEncodingTest(unittest.TestCase):
+    def assertRoundTrip(self, indices, n):
+        indices = np.asarray(indices, dtype=int)
+        encoded = encode_selection(indices, n)
+        np.testing.assert_array_equal(decode_selection(encoded), indices)
+        return encoded
+
+    def test_run_lengths(self):
+        mask = np.array([0, 0, 1, 1, 1, 0, 1], dtype=bool)
+        np.testing.assert_array_equal(run_lengths(mask), [2, 3, 1, 1])
+        # selected first point, empty unselected run
+        np.testing.assert_array_equal(run_lengths(mask[2:]), [0, 3, 1, 1])
+
+    def test_round_trip(self):
+        n = 1000
+        rng = np.random.RandomState(0)
+        for indices in ([], [0], [n - 1], [0, n - 1], range(100, 300), range(n),
+                        np.sort(rng.choice(n, 400, replace=False))):
+            self.assertRoundTrip(indices, n)
+        self.assertRoundTrip([], 0)
+
+    def test_chooses_smaller_encoding(self):
+        n = 10000
+        # one block: a few run lengths
+        block = self.assertRoundTrip(np.arange(2000, 5000), n)
+        self.assertTrue(block.startswith(RLE + ':'))
+
+        # scattered points: bit mask
+        scattered = np.sort(np.random.RandomState(0).choice(n, n // 2, replace=False))
+        self.assertTrue(self.assertRoundTrip(scattered, n).startswith(BITSET + ':'))
+
+    def test_explicit_encodings(self):
+        n = 77
+        indices = np.array([1, 2, 3, 40, 76])
+        mask = selection_mask(indices, n)
+        for encoded in (encode_rle(mask), encode_bitset(mask)):
+            np.testing.assert_array_equal(decode_selection(encoded), indices)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            decode_selection('json:[1, 2]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.resolwe.utils.spatial import GridIndex
+
+
+class GridIndexTest(unittest.TestCase):
+    def assertQuery(self, index, x, y, rect):
+        x0, x1, y0, y1 = rect
+        expected = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+        np.testing.assert_array_equal(np.sort(index.query(*rect)), expected)
+
+    def test_query(self):
+        rng = np.random.RandomState(0)
+        x, y = rng.normal(size=5000), rng.normal(size=5000) * 10
+        index = GridIndex(x, y, cells=32)
+        for _ in range(50):
+            x0, x1 = np.sort(rng.uniform(-4, 4, 2))
+            y0, y1 = np.sort(rng.uniform(-40, 40, 2))
+            self.assertQuery(index, x, y, (x0, x1, y0, y1))
+
+        # whole plot, outside of it and a degenerate rectangle
+        self.assertQuery(index, x, y, (-np.inf, np.inf, -np.inf, np.inf))
+        self.assertEqual(len(index.query(10, 11, 0, 1)), 0)
+        self.assertQuery(index, x, y, (x[0], x[0], y[0], y[0]))
+
+    def test_non_finite(self):
+        x = np.array([0, 1, np.nan, 2, np.inf])
+        y = np.array([0, 1, 1, np.nan, 2])
+        index = GridIndex(x, y)
+        np.testing.assert_array_equal(np.sort(index.query(-1, 3, -1, 3)), [0, 1])
+
+    def test_constant(self):
+        x = y = np.ones(10)
+        index = GridIndex(x, y)
+        self.assertEqual(len(index.query(0, 2, 0, 2)), 10)
+        self.assertEqual(len(GridIndex(np.array([np.nan]), np.array([np.nan])).query(0, 1, 0, 1)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import io
+import pickle
+import threading
+import unittest
+
+from concurrent.futures import CancelledError
+
+import numpy as np
+
+from orangecontrib.resolwe.utils.stream import (
+    ChunkedReader, can_stream, counted, interruptible, read_npy, split_extension
+)
+
+
+def npy_bytes(array, version=None):
+    f = io.BytesIO()
+    np.lib.format.write_array(f, array, version=version)
+    return f.getvalue()
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class ChunkedReaderTest(unittest.TestCase):
+    def test_read(self):
+        data = bytes(range(256)) * 10
+        progress = []
+        reader = ChunkedReader(split(data, 7), total_size=len(data), callback=progress.append)
+        self.assertEqual(io.BufferedReader(reader, 100).read(), data)
+        self.assertEqual(reader.bytes_read, len(data))
+        self.assertEqual(progress[-1], 100)
+        self.assertEqual(progress, sorted(progress))
+
+    def test_empty_chunks(self):
+        reader = ChunkedReader([b'', b'ab', b'', b'', b'c', b''])
+        self.assertEqual(reader.read(), b'abc')
+
+    def test_unpickle(self):
+        obj = {'x': np.arange(1000), 'name': 'table'}
+        reader = ChunkedReader(split(pickle.dumps(obj), 100))
+        loaded = pickle.load(io.BufferedReader(reader))
+        np.testing.assert_array_equal(loaded['x'], obj['x'])
+
+    def test_interruptible(self):
+        cancelled = threading.Event()
+        chunks = interruptible(iter([b'a', b'b', b'c']), cancelled)
+        self.assertEqual(next(chunks), b'a')
+        cancelled.set()
+        with self.assertRaises(CancelledError):
+            next(chunks)
+
+    def test_counted(self):
+        sizes = []
+        self.assertEqual(list(counted([b'ab', b'cde'], sizes.append)), [b'ab', b'cde'])
+        self.assertEqual(sizes, [2, 3])
+
+    def test_extensions(self):
+        self.assertEqual(split_extension('data.pickle.gz'), ('.pickle', '.gz'))
+        self.assertEqual(split_extension('data.TAB'), ('.tab', ''))
+        self.assertTrue(can_stream('data.tab.xz'))
+        self.assertFalse(can_stream('data.xlsx'))
+
+
+class ReadNpyTest(unittest.TestCase):
+    def test_versions_and_order(self):
+        arrays = [np.arange(12, dtype=np.float32).reshape(4, 3),
+                  np.asfortranarray(np.arange(12, dtype='<i8').reshape(3, 4)),
+                  np.arange(5, dtype='>f8'),
+                  np.zeros((0, 3))]
+        for array in arrays:
+            for version in ((1, 0), (2, 0)):
+                loaded = read_npy(npy_bytes(array, version))
+                np.testing.assert_array_equal(loaded, array)
+                self.assertEqual(loaded.dtype, array.dtype)
+
+    def test_zero_copy(self):
+        buffer = npy_bytes(np.arange(10.))
+        loaded = read_npy(buffer)
+        self.assertFalse(loaded.flags.writeable)
+        self.assertFalse(loaded.flags.owndata)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from concurrent.futures import CancelledError
+from unittest import mock
+
+import numpy as np
+
+from Orange.data import ContinuousVariable, Domain, Table
+
+from orangecontrib.resolwe.utils.transfer import (
+    ChunkedUpload, FORMATS, UPLOAD_RETRIES, UploadError, save_table
+)
+
+
+def random_table(n_rows=500, n_columns=20):
+    domain = Domain([ContinuousVariable('x{}'.format(i)) for i in range(n_columns)])
+    table = Table.from_numpy(domain, np.random.RandomState(0).rand(n_rows, n_columns))
+    table.name = 'random'
+    return table
+
+
+class SaveTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = random_table()
+        self.state_dir = tempfile.mkdtemp()
+
+    def checksums(self, transfer_format, now):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('time.time', return_value=now):
+            file_path = save_table(self.table, directory, transfer_format)
+            upload = ChunkedUpload('http://localhost/', None, file_path, self.state_dir,
+                                   chunk_size=4096)
+            return upload.checksums()
+
+    def test_same_table_same_chunks(self):
+        for transfer_format in FORMATS:
+            first = self.checksums(transfer_format, 1e9)
+            second = self.checksums(transfer_format, 2e9)
+            self.assertGreater(len(first), 1)
+            self.assertEqual(first, second, transfer_format)
+
+
+class Response:
+    def __init__(self, status_code, temp=None):
+        self.status_code = status_code
+        self._temp = temp
+
+    def json(self):
+        return {'files': [{'temp': self._temp}]}
+
+
+class Session:
+    """ Upload endpoint stand-in, failing requests for chunks in `fail`. """
+
+    def __init__(self):
+        self.fail = set()
+        self.fail_status = 500
+        self.attempts = 0
+        self.posted = []
+
+    def post(self, url, files, data, headers):
+        self.attempts += 1
+        chunk_number = data['_chunkNumber']
+        if chunk_number in self.fail:
+            return Response(self.fail_status)
+        self.posted.append((chunk_number, headers['X-File-Uid']))
+        return Response(200, 'temp-' + headers['X-File-Uid'])
+
+
+@mock.patch('orangecontrib.resolwe.utils.transfer.time.sleep', lambda _: None)
+class ChunkedUploadTest(unittest.TestCase):
+    chunk_size = 10
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'table.pickle')
+        self.write(bytes(range(45)))
+        self.session = Session()
+
+    def write(self, content):
+        with open(self.file_path, 'wb') as f:
+            f.write(content)
+
+    def upload(self, **kwargs):
+        return ChunkedUpload('http://localhost/', self.session, self.file_path, self.state_dir,
+                             chunk_size=self.chunk_size, **kwargs)
+
+    def test_upload(self):
+        progress = []
+        result = self.upload(progress_callback=progress.append).run()
+        self.assertEqual([number for number, _ in self.session.posted], [0, 1, 2, 3, 4])
+        self.assertEqual(result['file'], 'table.pickle')
+        self.assertEqual(progress[-1], 100)
+        # state is removed after a finished upload
+        self.assertFalse(os.listdir(self.state_dir))
+
+    def test_resume(self):
+        self.session.fail = {3}
+        with self.assertRaises(UploadError):
+            self.upload().run()
+        self.assertEqual([number for number, _ in self.session.posted], [0, 1, 2])
+
+        self.session.fail = set()
+        self.session.posted = []
+        result = self.upload().run()
+        # acknowledged chunks are skipped, the upload id is kept
+        self.assertEqual([number for number, _ in self.session.posted], [3, 4])
+        file_uid = self.session.posted[0][1]
+        self.assertEqual(result['file_temp'], 'temp-' + file_uid)
+
+    def test_retries(self):
+        self.session.fail = {0}
+        with self.assertRaises(UploadError):
+            self.upload().run()
+        self.assertEqual(self.session.attempts, UPLOAD_RETRIES)
+
+    def test_client_error_not_retried(self):
+        self.session.fail = {0}
+        self.session.fail_status = 403
+        with self.assertRaises(UploadError):
+            self.upload().run()
+        self.assertEqual(self.session.attempts, 1)
+
+    def test_changed_file_not_resumed(self):
+        self.session.fail = {3}
+        with self.assertRaises(UploadError):
+            self.upload().run()
+
+        # same size, different content of the second chunk
+        content = bytearray(range(45))
+        content[15] = 255
+        self.write(bytes(content))
+        self.session.fail = set()
+        self.session.posted = []
+        self.upload().run()
+        self.assertEqual([number for number, _ in self.session.posted], [1, 2, 3, 4])
+
+    def test_cancel(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        with self.assertRaises(CancelledError):
+            self.upload().run(cancelled)
+        self.assertFalse(self.session.posted)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,40 @@
 """ Utils for resolwe sdk """
 import tempfile
+import threading
 import os
-import asyncio
 
 from os import environ
-from resdk.resolwe import Resolwe
-from concurrent.futures import wait
+from typing import Callable, Optional
+from urllib.parse import urljoin
+from concurrent.futures import wait, TimeoutError
+
+from resdk.resources.data import Data
 
 from Orange.data import Table
+from Orange.misc.environ import cache_dir
+
+from orangecontrib.resolwe.utils.cache import DataListing, get_listing, get_table_cache
+from orangecontrib.resolwe.utils.session import get_session
+from orangecontrib.resolwe.utils.stream import (
+    CHUNK_SIZE, ChunkedReader, can_stream, counted, interruptible, read_npy, read_table
+)
+from orangecontrib.resolwe.utils.transfer import (
+    ChunkedUpload, choose_format, save_table, sparsify
+)
 
 DEFAULT_URL = 'http://127.0.0.1:8000/'
 DEFAULT_USERNAME = 'admin'
 DEFAULT_PASSWORD = 'admin123'
+DEFAULT_NOTIFICATIONS_URL = ''
+DEFAULT_COMPRESS_UPLOADS = False
+
+#: Seconds to wait for a process to finish (None waits indefinitely)
+DEFAULT_TIMEOUT = 60
+PROCESS_TIMEOUTS = {
+    't-sne': 30 * 60,
+}
+#: More changed Data objects than this drop the cached listing
+LISTING_MAX_CHANGES = 100
 
 
 def set_resolwe_url(url=DEFAULT_URL):
@@ -26,17 +49,51 @@ def set_resolwe_password(password=DEFAULT_PASSWORD):
     environ['RESOLWE_API_PASSWORD'] = password
 
 
+def set_resolwe_notifications_url(url=DEFAULT_NOTIFICATIONS_URL):
+    environ['RESOLWE_NOTIFICATIONS_URL'] = url
+
+
+def set_resolwe_compress_uploads(compress=DEFAULT_COMPRESS_UPLOADS):
+    environ['RESOLWE_COMPRESS_UPLOADS'] = '1' if compress else ''
+
+
+class ProcessTimeout(TimeoutError):
+    """ Process did not finish in time, but is still running on the server. """
+
+    def __init__(self, data_object):
+        super().__init__('Process {} (Data {}) is still running'.format(
+            data_object.process_name, data_object.id))
+        self.data_object = data_object
+
+
+class ProcessError(RuntimeError):
+    """ Process finished with an error. """
+
+    def __init__(self, data_object):
+        message = '\n'.join(data_object.process_error or [])
+        super().__init__(message or 'Process {} (Data {}) failed'.format(
+            data_object.process_name, data_object.id))
+        self.data_object = data_object
+
+
 class ResolweTask:
     future = None
     watcher = None
     cancelled = False
+    #: result cache key of an embedding task
+    key = None
+    #: the task continues from a previous embedding
+    warm_start = False
 
     def __init__(self, slug):
         # type: (str) -> None
         self.slug = slug
+        # set on cancel, checked by long running functions
+        self.interrupt = threading.Event()
 
     def cancel(self):
         self.cancelled = True
+        self.interrupt.set()
         self.future.cancel()
         wait([self.future])
 
@@ -47,37 +104,88 @@ class ResolweHelper:
         self.url = environ.get('RESOLWE_HOST_URL', DEFAULT_URL)
         self.username = environ.get('RESOLWE_API_USERNAME', DEFAULT_USERNAME)
         self.password = environ.get('RESOLWE_API_PASSWORD', DEFAULT_PASSWORD)
-
-        try:
-            self.res = Resolwe(self.username, self.password, self.url)
-        except Exception:
-            # TODO: raise proper exceptions and handle in GUI
-            raise
-
-    @staticmethod
-    async def check_object_status(data_object):
-        while True:
-            data_object.update()
-            if data_object.status == 'OK' or data_object.status == 'ER':
-                return True
-
-            await asyncio.sleep(0.5)
+        # websocket endpoint of server-side data change notifications, e.g. ws://127.0.0.1:8000/ws/
+        self.notifications_url = environ.get('RESOLWE_NOTIFICATIONS_URL', DEFAULT_NOTIFICATIONS_URL)
+        # only servers whose Orange reads compressed pickles (.pickle.gz etc.)
+        self.compress_uploads = bool(environ.get('RESOLWE_COMPRESS_UPLOADS', DEFAULT_COMPRESS_UPLOADS))
+
+        # shared between all helpers, login happens on first request
+        self.session = get_session(self.url, self.username, self.password)
+        self.timeouts = dict(PROCESS_TIMEOUTS)
+        self._process_inputs = {}
+
+    @property
+    def res(self):
+        return self.session.res
+
+    @property
+    def scheduler(self):
+        return self.session.scheduler(self.notifications_url)
+
+    @property
+    def cache(self):
+        return get_table_cache()
+
+    @property
+    def upload_state_dir(self):
+        directory = os.path.join(cache_dir(), 'resolwe', 'uploads')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def get_timeout(self, slug):
+        # type: (str) -> Optional[float]
+        return self.timeouts.get(slug, DEFAULT_TIMEOUT)
+
+    def set_timeout(self, slug, timeout):
+        # type: (str, Optional[float]) -> None
+        self.timeouts[slug] = timeout
+
+    def check_object_status(self, data_object, timeout=None, on_update=None, cancelled=None):
+        return self.scheduler.wait(data_object, timeout=timeout, on_update=on_update,
+                                   cancelled=cancelled)
+
+    def start_process(self, slug, **kwargs):
+        return self.res.get_or_run(slug, input={**kwargs})
+
+    def wait_process(self, data_object, timeout=None, on_update=None, cancelled=None):
+        """ Wait for `data_object` and return it, finished or not.
+
+        `on_update` is called with the running object whenever the shared
+        status scheduler sees it change, e.g. to show progress or
+        intermediate outputs. Waiting stops early when the `cancelled`
+        event is set.
+        """
+        self.check_object_status(data_object, timeout=timeout, on_update=on_update,
+                                 cancelled=cancelled)
+        return data_object
 
     def run_process(self, slug, **kwargs):
 
-        process = self.res.get_or_run(slug, input={**kwargs})
+        process = self.start_process(slug, **kwargs)
         if process.status == 'OK':
             return process
 
         # wait till task is finished
-        loop = asyncio.new_event_loop()
-        try:
-            loop.run_until_complete(asyncio.wait_for(self.check_object_status(process), timeout=60))
-        finally:
-            loop.close()
+        if not self.check_object_status(process, timeout=self.get_timeout(slug)):
+            raise ProcessTimeout(process)
 
         return process
 
+    def resume_process(self, data_id, slug=None, on_update=None, cancelled=None):
+        process = self.get_object(id=data_id)
+        timeout = self.get_timeout(slug) if slug else DEFAULT_TIMEOUT
+        return self.wait_process(process, timeout=timeout, on_update=on_update,
+                                 cancelled=cancelled)
+
+    def process_inputs(self, slug):
+        # type: (str) -> set
+        """ Input names of the latest version of process `slug`. """
+        if slug not in self._process_inputs:
+            processes = self.res.process.filter(slug=slug, ordering='-version')[:1]
+            self._process_inputs[slug] = {
+                field['name'] for process in processes for field in process.input_schema}
+        return self._process_inputs[slug]
+
     def get_json(self, data_object, output_field, json_field=None):
         storage_data = self.res.api.storage(data_object.output[output_field]).get()
         if json_field:
@@ -85,16 +193,88 @@ class ResolweHelper:
         else:
             return storage_data['json']
 
+    def get_array(self, data_object, output_field):
+        """ Download a `basic:file:` output saved with numpy.save as an array. """
+        return self.get_array_if_changed(data_object, output_field)[0]
+
+    def get_array_if_changed(self, data_object, output_field, etag=None):
+        """ Like `get_array`, but return the array with the file's ETag.
+
+        With the `etag` of an earlier download, the file is only sent if
+        it changed since; otherwise the returned array is None.
+        """
+        file_name = data_object.output[output_field]['file']
+        url = urljoin(self.url, 'data/{}/{}'.format(data_object.id, file_name))
+        headers = {'If-None-Match': etag} if etag else {}
+        response = self.session.http_session(self.res).get(url, headers=headers)
+        if etag and response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return read_npy(response.content), response.headers.get('ETag')
+
     def get_object(self, *args, **kwargs):
         return self.res.data.get(*args, **kwargs)
 
-    def list_data_objects(self, data_type):
-        return self.res.data.filter(type='data:table:{}'.format(data_type))
+    @staticmethod
+    def _data_filters(data_type, search=None):
+        filters = {'type': 'data:table:{}'.format(data_type)}
+        if search:
+            filters['name__icontains'] = search
+        return filters
+
+    def list_data_objects(self, data_type, offset=None, limit=None, ordering=None, search=None):
+        filters = self._data_filters(data_type, search)
+        if ordering:
+            filters['ordering'] = ordering
+
+        query = self.res.data.filter(**filters)
+        if limit is None:
+            return query
+        # fetch a single page
+        offset = offset or 0
+        return list(query[offset:offset + limit])
+
+    def count_queued_processes(self):
+        """ Number of Data objects waiting for a free executor on the server. """
+        return self.res.data.filter(status='WT').count()
+
+    def count_data_objects(self, data_type, search=None):
+        return self.res.data.filter(**self._data_filters(data_type, search)).count()
 
     def get_descriptor_schema(self, slug):
         return self.res.descriptor_schema.get(slug)
 
-    def upload_data_table(self, data_table):
+    def data_listing(self, data_type):
+        # type: (str) -> DataListing
+        """ Locally cached listing of Data objects, see `update_listing`. """
+        return get_listing(self.url, data_type)
+
+    def update_listing(self, listing, data_type, descriptor_schema=None):
+        # type: (DataListing, str, Optional[str]) -> int
+        """ Bring the cached `listing` up to date with the server.
+
+        Only Data objects changed since the listing was last updated are
+        fetched. If there are more than LISTING_MAX_CHANGES of them, or
+        objects were deleted, the cached rows are dropped and the browser
+        pages them in again. Return the number of Data objects on the server.
+        """
+        if descriptor_schema is not None:
+            listing.set_descriptor_schema(self.get_descriptor_schema(descriptor_schema))
+
+        count = self.count_data_objects(data_type)
+        changed = []
+        if listing.modified:
+            query = self.list_data_objects(data_type).filter(modified__gt=listing.modified)
+            changed = list(query[:LISTING_MAX_CHANGES + 1])
+
+        if len(changed) > LISTING_MAX_CHANGES or not listing.merge(changed, count):
+            listing.clear()
+            listing.count = count
+        listing.save()
+        return count
+
+    def upload_data_table(self, data_table, transfer_format=None, progress_callback=None,
+                          cancelled=None):
 
         if not data_table and isinstance(data_table, Table):
             # raise proper warning
@@ -102,18 +282,100 @@ class ResolweHelper:
 
         # create temp dir and pickle data.Table object
         with tempfile.TemporaryDirectory() as temp_dir:
-            # TODO: What to do if Table is not named?
-            file_name = data_table.name + '.pickle'
-            file_path = os.path.join(temp_dir, file_name)
-            # save Table as pickled object
-            data_table.save(file_path)
-            # run resolwe upload process
-            self.res.run('data-table-upload', input={'src': file_path})
-
-    @staticmethod
-    def download_data_table(data_table_object):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            data_table_object.download(download_dir=temp_dir)
-            return Table(os.path.join(temp_dir, data_table_object.name))
+            # save Table as (compressed) pickled object, count data in sparse format
+            data_table = sparsify(data_table)
+            transfer_format = transfer_format or choose_format(data_table, self.compress_uploads)
+            file_path = save_table(data_table, temp_dir, transfer_format)
+            # chunked upload, resumed if a previous attempt failed
+            upload = ChunkedUpload(self.url, self.session.http_session(self.res), file_path,
+                                   self.upload_state_dir, progress_callback=progress_callback)
+            src = upload.run(cancelled)
+
+        # run resolwe upload process
+        model_data = self.res.api.data.post({'process': 'data-table-upload',
+                                             'input': {'src': src}})
+        return Data(resolwe=self.res, **model_data)
+
+    def download_data_table(self, data_table_object, progress_callback=None, use_cache=True,
+                            mmap=False, cancelled=None):
+        if not use_cache:
+            return self._fetch_data_table(data_table_object, progress_callback, cancelled)
+
+        # cheap metadata request, detects tables changed on the server
+        data_table_object.update()
+        key = self.cache.key(self.url, data_table_object)
+        table = self.cache.get(key, mmap=mmap)
+        if table is not None:
+            return table
+
+        # stored in the other mode, e.g. by prefetching
+        table = self.cache.read(key, mmap=not mmap)
+        if table is not None and not mmap:
+            # writable copy of the memory-mapped arrays
+            return table.copy()
+
+        if table is None:
+            table = self._fetch_data_table(data_table_object, progress_callback, cancelled)
+        self.cache.put(key, table, mmap=mmap)
+        if mmap:
+            # drop the downloaded arrays in favour of the memory-mapped copy
+            table = self.cache.read(key, mmap=True) or table
+        return table
+
+    def cached_data_table(self, data_table_object):
+        """ Return the table of `data_table_object` if it is in the table cache, or None.
+
+        Unlike `download_data_table`, the table is never downloaded.
+        """
+        data_table_object.update()
+        key = self.cache.key(self.url, data_table_object)
+        table = self.cache.read(key, mmap=True)
+        if table is None:
+            table = self.cache.read(key)
+        return table
+
+    def prefetch_data_table(self, data_id, cancelled=None, bytes_callback=None):
+        # type: (int, Optional[threading.Event], Optional[Callable[[int], None]]) -> bool
+        """ Download the table of Data object `data_id` into the cache.
+
+        Downloaded bytes are reported to `bytes_callback` as they arrive,
+        also for downloads that are cancelled later. Return False if the
+        table was already cached.
+        """
+        data_table_object = self.get_object(id=data_id)
+        key = self.cache.key(self.url, data_table_object)
+        if key in self.cache:
+            return False
+
+        self.cache.put(key, self._fetch_data_table(
+            data_table_object, cancelled=cancelled, bytes_callback=bytes_callback))
+        return True
+
+    def _fetch_data_table(self, data_table_object, progress_callback=None, cancelled=None,
+                          bytes_callback=None):
+        output = (data_table_object.output or {}).get('table') or {}
+        file_name = output.get('file')
+
+        if not file_name or not can_stream(file_name):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                data_table_object.download(download_dir=temp_dir)
+                file_path = os.path.join(temp_dir, data_table_object.name)
+                if bytes_callback is not None:
+                    bytes_callback(os.path.getsize(file_path))
+                return Table(file_path)
+
+        # read the response straight into the table loader
+        url = urljoin(self.url, 'data/{}/{}'.format(data_table_object.id, file_name))
+        response = self.session.http_session(self.res).get(url, stream=True)
+        with response:
+            response.raise_for_status()
+            size = output.get('size') or int(response.headers.get('Content-Length', 0))
+            chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+            if bytes_callback is not None:
+                chunks = counted(chunks, bytes_callback)
+            if cancelled is not None:
+                chunks = interruptible(chunks, cancelled)
+            reader = ChunkedReader(chunks, total_size=size, callback=progress_callback)
+            return read_table(reader, file_name)
 
 
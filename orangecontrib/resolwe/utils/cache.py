@@ -0,0 +1,400 @@
+""" Local on-disk cache of downloaded data tables and dataset listings """
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional
+
+from Orange.data import Table
+from Orange.misc.environ import cache_dir
+
+
+#: Size limit of the cache directory in bytes
+MAX_CACHE_SIZE = 2 * 1024 ** 3
+
+
+class TableCache:
+    """ Least recently used cache of tables keyed by Data object version.
+
+    Keys are derived from the server url, Data id, its modification time
+    and the table output file, so a changed Data object never hits a stale
+    entry. When the directory grows over `max_size` bytes, least recently
+    used entries are removed.
+
+    Tables are stored either pickled or, with ``mmap=True``, as a
+    directory of ``.npy`` arrays that are memory-mapped when loaded, so
+    large tables are paged in on demand and their pages are shared by
+    all tables opened from the same entry. Sparse X is stored as its
+    CSR arrays and rebuilt as a sparse matrix over the mapped arrays.
+    """
+
+    EXTENSION = '.pickle'
+    MMAP_EXTENSION = '.table'
+    #: Table arrays stored as memory-mappable .npy files
+    MMAP_ARRAYS = ('X', 'Y', 'W')
+
+    def __init__(self, directory=None, max_size=MAX_CACHE_SIZE):
+        # type: (Optional[str], int) -> None
+        self.directory = directory or os.path.join(cache_dir(), 'resolwe', 'tables')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(url, data_object):
+        # type: (str, ...) -> str
+        output = (data_object.output or {}).get('table') or {}
+        version = '|'.join(str(value) for value in (
+            url, data_object.id, data_object.modified, output.get('file'), output.get('size')))
+        return hashlib.sha1(version.encode('utf-8')).hexdigest()
+
+    def path(self, key, mmap=False):
+        # type: (str, bool) -> str
+        return os.path.join(self.directory, key + (self.MMAP_EXTENSION if mmap else self.EXTENSION))
+
+    def _entries(self):
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith((self.EXTENSION, self.MMAP_EXTENSION)):
+                yield os.path.join(self.directory, file_name)
+
+    @staticmethod
+    def _size(path):
+        if not os.path.isdir(path):
+            return os.stat(path).st_size
+        return sum(os.stat(os.path.join(path, file_name)).st_size
+                   for file_name in os.listdir(path))
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def __contains__(self, key):
+        return any(os.path.exists(self.path(key, mmap)) for mmap in (True, False))
+
+    def get(self, key, mmap=False):
+        # type: (str, bool) -> Optional[Table]
+        """ Return the table stored under `key` in the requested mode.
+
+        Only memory-mapped entries are returned with ``mmap=True``, and
+        only pickled ones otherwise, so callers never receive read-only
+        arrays they did not ask for.
+        """
+        table = self.read(key, mmap)
+        with self._lock:
+            if table is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return table
+
+    def read(self, key, mmap=False):
+        # type: (str, bool) -> Optional[Table]
+        """ Like `get`, but without counting a hit or miss. """
+        path = self.path(key, mmap)
+        if not os.path.exists(path):
+            return None
+        try:
+            table = self._load_mmap(path) if mmap else self._load_pickle(path)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        return table
+
+    def put(self, key, table, mmap=False):
+        # type: (str, Table, bool) -> None
+        temp_path = tempfile.mkdtemp(dir=self.directory, suffix='.tmp')
+        try:
+            if mmap:
+                self._save_mmap(temp_path, table)
+                path = self.path(key, mmap=True)
+                if os.path.isdir(path):
+                    # a non-empty directory can not be replaced
+                    self._remove(path)
+                os.replace(temp_path, path)
+            else:
+                self._save_pickle(os.path.join(temp_path, 'table.pickle'), table)
+                os.replace(os.path.join(temp_path, 'table.pickle'), self.path(key))
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(temp_path):
+                shutil.rmtree(temp_path)
+        self.evict()
+
+    @staticmethod
+    def _load_pickle(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def _save_pickle(path, table):
+        with open(path, 'wb') as f:
+            pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _load_mmap(self, path):
+        with open(os.path.join(path, 'table.pickle'), 'rb') as f:
+            state = pickle.load(f)
+
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        arrays = {name: load(name) for name in self.MMAP_ARRAYS if name != 'X'}
+        if state.get('X_shape') is not None:
+            arrays['X'] = sp.csr_matrix(
+                (load('X_data'), load('X_indices'), load('X_indptr')),
+                shape=state['X_shape'], copy=False)
+        else:
+            arrays['X'] = load('X')
+
+        table = Table.from_numpy(state['domain'], arrays['X'], arrays['Y'],
+                                 state['metas'], arrays['W'])
+        table.ids = state['ids']
+        table.attributes = state['attributes']
+        table.name = state['name']
+        return table
+
+    def _save_mmap(self, path, table):
+        arrays = {name: getattr(table, name) for name in self.MMAP_ARRAYS}
+        X_shape = None
+        if sp.issparse(table.X):
+            X = arrays.pop('X').tocsr()
+            X_shape = X.shape
+            arrays.update(X_data=X.data, X_indices=X.indices, X_indptr=X.indptr)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+        # metas hold python objects and can not be memory-mapped
+        state = {'domain': table.domain, 'metas': table.metas, 'ids': table.ids,
+                 'attributes': table.attributes, 'name': table.name, 'X_shape': X_shape}
+        self._save_pickle(os.path.join(path, 'table.pickle'), state)
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for path in self._entries():
+                try:
+                    entries.append((os.stat(path).st_mtime, self._size(path), path))
+                except OSError:
+                    continue
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    self._remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            for path in self._entries():
+                self._remove(path)
+
+
+#: Column of the dataset browser showing the Data object's name
+NAME_COLUMN = 'file_name'
+
+#: Cached row of the dataset browser: Data id, modification time and displayed values
+ListedData = namedtuple('ListedData', ['id', 'modified', 'created', 'values'])
+#: Cached descriptor schema
+ListedSchema = namedtuple('ListedSchema', ['slug', 'schema'])
+
+
+def header_schema(descriptor_schema):
+    # type: (...) -> List[dict]
+    """ Fields of the descriptor's tabular group, the browser's columns. """
+    if descriptor_schema is None:
+        return []
+    return [value for schema_value in descriptor_schema.schema
+            if schema_value['name'] == 'tabular' for value in schema_value['group']]
+
+
+def row_values(header, obj):
+    # type: (List[dict], ...) -> list
+    """ Values of Data object `obj` in columns `header`. """
+    values = []
+    tabular_data = (obj.descriptor or {}).get('tabular', None)
+    output_data = (obj.output or {}).get('table', None)
+
+    # TODO: refactor this. Use file_name and size from obj.output instead of desc. schema
+    for schema_value in header:
+        schema_key = schema_value['name']
+        data_info = tabular_data.get(schema_key, '?') if tabular_data else '?'
+
+        if schema_key == NAME_COLUMN and getattr(obj, 'name', None):
+            # sorted and searched by the server
+            data_info = obj.name
+        elif schema_key == 'file_name' and data_info == '?':
+            data_info = output_data.get('file', '?') if output_data else '?'
+        elif schema_key == 'file_size' and data_info == '?':
+            data_info = output_data.get('size', '?') if output_data else '?'
+
+        values.append(data_info)
+
+    return values
+
+
+class DataListing:
+    """ Leading rows of the dataset browser, persisted between sessions.
+
+    Rows are the displayed values of Data objects in the server's default
+    order (by id), added page by page as they are fetched, so the browser
+    can show them before the server responds and continue paging after
+    them. `complete` is set once the last page was added.
+
+    `modified` is the latest modification time seen; `merge` applies
+    objects changed after it. `count` is the number of objects on the
+    server at the last update.
+    """
+
+    def __init__(self, path):
+        # type: (str) -> None
+        self.path = path
+        self.objects = {}               # type: Dict[int, ListedData]
+        self.descriptor_schema = None   # type: Optional[ListedSchema]
+        self.modified = None            # type: Optional[str]
+        self.count = None               # type: Optional[int]
+        self.complete = False
+        self._lock = threading.RLock()
+        self.load()
+
+    def __len__(self):
+        return len(self.objects)
+
+    def rows(self):
+        # type: () -> List[ListedData]
+        with self._lock:
+            return [self.objects[data_id] for data_id in sorted(self.objects)]
+
+    def _listed(self, header, obj):
+        if obj.modified and (self.modified is None or obj.modified > self.modified):
+            self.modified = obj.modified
+        return ListedData(obj.id, obj.modified, obj.created, row_values(header, obj))
+
+    def add_page(self, offset, data_objects, complete):
+        # type: (int, Iterable, bool) -> None
+        """ Add a page of Data objects fetched at `offset` in the default order. """
+        header = header_schema(self.descriptor_schema)
+        with self._lock:
+            if not header or offset != len(self.objects) or self.complete:
+                # unknown columns, or not a continuation of the listed rows
+                return
+            for obj in data_objects:
+                self.objects[obj.id] = self._listed(header, obj)
+            self.complete = complete
+
+    def merge(self, data_objects, count):
+        # type: (Iterable, int) -> bool
+        """ Merge Data objects changed since `modified`, with `count` objects on the server.
+
+        Listed rows are updated, objects created since are appended if the
+        listing is complete (later pages are fetched anyway). Return False if
+        the listing does not add up to `count`, e.g. objects were deleted.
+        """
+        header = header_schema(self.descriptor_schema)
+        with self._lock:
+            watermark, last_id = self.modified, max(self.objects, default=None)
+            created = 0
+            for obj in data_objects:
+                if watermark is not None and obj.created and obj.created > watermark:
+                    created += 1
+                if obj.id in self.objects or self.complete:
+                    self.objects[obj.id] = self._listed(header, obj)
+                elif last_id is not None and obj.id < last_id:
+                    # an object between listed rows
+                    return False
+                else:
+                    self._listed(header, obj)
+
+            consistent = self.count is None or self.count + created == count
+            if self.complete:
+                consistent = consistent and len(self.objects) == count
+            self.count = count
+            return consistent
+
+    def clear(self):
+        with self._lock:
+            self.objects = {}
+            self.modified = None
+            self.complete = False
+
+    def set_descriptor_schema(self, descriptor_schema):
+        schema = ListedSchema(descriptor_schema.slug, descriptor_schema.schema)
+        with self._lock:
+            if schema != self.descriptor_schema:
+                # cached values belong to other columns
+                self.clear()
+            self.descriptor_schema = schema
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        try:
+            self.objects = {obj['id']: ListedData(**obj) for obj in state.get('objects', [])}
+        except TypeError:
+            # written by an older version
+            return
+        self.modified = state.get('modified')
+        self.count = state.get('count')
+        self.complete = state.get('complete', False)
+        if state.get('descriptor_schema'):
+            self.descriptor_schema = ListedSchema(**state['descriptor_schema'])
+
+    def save(self):
+        with self._lock:
+            state = {
+                'objects': [obj._asdict() for obj in self.rows()],
+                'descriptor_schema': self.descriptor_schema and self.descriptor_schema._asdict(),
+                'modified': self.modified,
+                'count': self.count,
+                'complete': self.complete,
+            }
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
+
+
+def get_listing(url, data_type):
+    # type: (str, str) -> DataListing
+    directory = os.path.join(cache_dir(), 'resolwe', 'listings')
+    os.makedirs(directory, exist_ok=True)
+    key = hashlib.sha1('|'.join((url, data_type)).encode('utf-8')).hexdigest()
+    return DataListing(os.path.join(directory, key + '.json'))
+
+
+_table_cache = None
+_table_cache_lock = threading.Lock()
+
+
+def get_table_cache():
+    # type: () -> TableCache
+    global _table_cache
+    with _table_cache_lock:
+        if _table_cache is None:
+            _table_cache = TableCache()
+        return _table_cache
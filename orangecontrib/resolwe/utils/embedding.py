@@ -0,0 +1,127 @@
+""" Local t-SNE embedding, an alternative to the server's t-sne process """
+import os
+import threading
+
+from collections import namedtuple
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+try:
+    import openTSNE
+except ImportError:
+    openTSNE = None
+
+
+#: Tables with at most this many rows are embedded locally in automatic mode
+LOCAL_MAX_ROWS = 5000
+#: With this many processes waiting on the server, larger tables are embedded locally too
+BUSY_QUEUE = 5
+BUSY_MAX_ROWS = 50000
+#: Limits on the table file size (bytes) if the number of rows is not annotated
+LOCAL_MAX_BYTES = 5 * 1024 ** 2
+BUSY_MAX_BYTES = 50 * 1024 ** 2
+
+#: Result of a local run; `class_var` has the format of the process' class_var output
+LocalEmbedding = namedtuple('LocalEmbedding', ['embedding', 'class_var', 'table'])
+
+
+def table_size(data_object):
+    # type: (...) -> Tuple[Optional[int], Optional[int]]
+    """ Number of rows and file size of a data table, as far as the server knows them.
+
+    Rows come from the descriptor's `cells` annotation and the size from
+    the `table` output, so neither needs the table to be downloaded.
+    """
+    def number(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    tabular = (data_object.descriptor or {}).get('tabular') or {}
+    table = (data_object.output or {}).get('table') or {}
+    return number(tabular.get('cells')), number(table.get('size') or tabular.get('file_size'))
+
+
+def prefer_local(data_object, queued):
+    # type: (..., int) -> bool
+    """ Is the table of `data_object` faster embedded locally, with `queued` jobs on the server.
+
+    Tables of unknown size are left to the server.
+    """
+    n_rows, size = table_size(data_object)
+    busy = queued >= BUSY_QUEUE
+    if n_rows is not None:
+        return n_rows <= LOCAL_MAX_ROWS or (busy and n_rows <= BUSY_MAX_ROWS)
+    if size is not None:
+        return size <= LOCAL_MAX_BYTES or (busy and size <= BUSY_MAX_BYTES)
+    return False
+
+
+def pca(X, n_components):
+    # type: (...) -> np.ndarray
+    n_components = min(n_components, min(X.shape))
+    if sp.issparse(X):
+        from sklearn.decomposition import TruncatedSVD
+        return TruncatedSVD(n_components=n_components, random_state=0).fit_transform(X)
+
+    from sklearn.decomposition import PCA
+    return PCA(n_components=n_components, svd_solver='randomized',
+               random_state=0).fit_transform(X)
+
+
+class PCACache:
+    """ PCA projections by key, truncated for smaller component counts. """
+
+    def __init__(self):
+        self._projections = {}  # type: Dict[Hashable, Tuple[int, np.ndarray]]
+        self._lock = threading.Lock()
+
+    def get(self, key, X, n_components):
+        # type: (Hashable, ..., int) -> np.ndarray
+        with self._lock:
+            cached = self._projections.get(key)
+        if cached is None or cached[0] < n_components:
+            cached = (n_components, pca(X, n_components))
+            with self._lock:
+                self._projections[key] = cached
+        return cached[1][:, :n_components]
+
+
+def tsne(X, perplexity=30, iterations=300, n_jobs=None):
+    # type: (np.ndarray, float, int, Optional[int]) -> np.ndarray
+    """ Embed rows of X in two dimensions. Meant to run in a worker process.
+
+    Uses openTSNE (FFT accelerated) if installed, otherwise Barnes-Hut
+    t-SNE from scikit-learn. `n_jobs` applies to openTSNE only, the
+    scikit-learn fallback runs on a single core.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    # both implementations need perplexity well below the number of points
+    perplexity = max(min(perplexity, (len(X) - 1) / 3), 1)
+
+    if openTSNE is not None:
+        embedding = openTSNE.TSNE(perplexity=perplexity, n_iter=iterations,
+                                  n_jobs=n_jobs, random_state=0).fit(X)
+        return np.asarray(embedding, dtype=np.float32)
+
+    from sklearn.manifold import TSNE
+    kwargs = dict(n_components=2, perplexity=perplexity, method='barnes_hut', random_state=0)
+    try:
+        model = TSNE(max_iter=iterations, **kwargs)
+    except TypeError:
+        # scikit-learn < 1.5
+        model = TSNE(n_iter=iterations, **kwargs)
+    return model.fit_transform(X).astype(np.float32)
+
+
+def class_var_info(table):
+    """ Class variable of `table` as in the t-sne process' class_var output. """
+    class_var = table.domain.class_var
+    if class_var is None or not class_var.is_discrete:
+        return None
+    return {'name': class_var.name,
+            'values': list(class_var.values),
+            'y_data': table.get_column_view(class_var)[0].astype(float)}
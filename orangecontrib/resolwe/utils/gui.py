@@ -1,122 +1,291 @@
 """ PyQt components for resolwe add-on"""
-from AnyQt.QtCore import Qt
-from AnyQt.QtWidgets import QWidget, QTreeView, QVBoxLayout
-from AnyQt.QtGui import QStandardItem, QStandardItemModel
+from AnyQt.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer, pyqtSignal as Signal, \
+    pyqtSlot as Slot
+from AnyQt.QtWidgets import QWidget, QTreeView, QVBoxLayout, QLineEdit
 
 
 from Orange.widgets.data.owdatasets import variable_icon
-from resdk.resources.data import Data
+from Orange.widgets.utils.concurrent import FutureWatcher
 from collections import namedtuple
+from concurrent.futures import Future
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+
+from orangecontrib.resolwe.utils.cache import (
+    NAME_COLUMN, DataListing, header_schema, row_values
+)
+
+
+#: Number of Data objects requested from the server at once
+PAGE_SIZE = 100
+
+#: Server-side ordering fields of sortable columns. The server orders Data
+#: objects by their own fields only, not by descriptor values, so other
+#: columns can not be sorted.
+SORT_FIELDS = {
+    NAME_COLUMN: 'name',
+}
+#: Ordering of pages without a sorted column, the order of cached listings
+DEFAULT_ORDERING = 'id'
+
+#: Milliseconds of typing inactivity before search is sent to the server
+SEARCH_DELAY = 300
+
+
+class DataObjectsModel(QAbstractTableModel):
+    """ Table of Data objects, fetched from the server page by page.
+
+    Only the displayed descriptor values and the id of every Data object
+    are kept. `fetch_page(offset, limit)` is called by the view whenever
+    it needs more rows and should return a Future of the page, e.g. from
+    a worker thread; the rows are appended when it is done. A page shorter
+    than `page_size` marks the end. Paging continues after rows given as
+    `cached_rows`, unless `complete` is set.
+    """
+
+    #: Fetching a page failed with the given exception
+    fetchFailed = Signal(object)
+    #: A page of Data objects was fetched at the given offset
+    pageFetched = Signal(int, list)
+
+    def __init__(self, header_schema, fetch_page=None, page_size=PAGE_SIZE, parent=None,
+                 cached_rows=(), complete=False):
+        super().__init__(parent)
+        self.header_schema = header_schema
+        self.fetch_page = fetch_page    # type: Optional[Callable[[int, int], Future]]
+        self.page_size = page_size
+        self.target_column = None       # type: Optional[int]
+
+        self._rows = [(row.id, row.values) for row in cached_rows]  # type: List[Tuple[int, list]]
+        self._can_fetch_more = fetch_page is not None and not complete
+        self._pending = None            # type: Optional[FutureWatcher]
+
+    def row_values(self, obj):
+        return row_values(self.header_schema, obj)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.header_schema)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.header_schema[section].get('label', '?')
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        value = self._rows[index.row()][1][index.column()]
+        if role == Qt.DisplayRole:
+            return value
+        if role == Qt.DecorationRole and index.column() == self.target_column and value:
+            return variable_icon(value)
+        return None
+
+    def canFetchMore(self, parent):
+        # one page at a time
+        return not parent.isValid() and self._can_fetch_more and self._pending is None
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        self._pending = FutureWatcher(self.fetch_page(len(self._rows), self.page_size), self)
+        self._pending.done.connect(self.__page_fetched)
+
+    @Slot(Future)
+    def __page_fetched(self, future):
+        self._pending = None
+        try:
+            data_objects = list(future.result())
+        except Exception as ex:
+            # stop fetching, a new model is created on refresh
+            self._can_fetch_more = False
+            self.fetchFailed.emit(ex)
+            return
+        self.pageFetched.emit(len(self._rows), data_objects)
+        self.append_page(data_objects)
+
+    def append_page(self, data_objects):
+        data_objects = list(data_objects)
+        if len(data_objects) < self.page_size:
+            self._can_fetch_more = False
+        if not data_objects:
+            return
+
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(data_objects) - 1)
+        self._rows.extend((obj.id, self.row_values(obj)) for obj in data_objects)
+        self.endInsertRows()
+
+    def data_id(self, row):
+        # type: (int) -> int
+        return self._rows[row][0]
+
+    def value(self, row, column):
+        return self._rows[row][1][column]
+
+    def data_row(self, data_id):
+        # type: (int) -> Optional[int]
+        return next((row for row, (row_id, _) in enumerate(self._rows) if row_id == data_id), None)
 
 
 class ResolweDataWidget(QWidget):
+    """ Browser of Data objects on the server.
+
+    `fetch_page(offset, limit, ordering=None, search=None)` should return
+    a Future of a page of Data objects. Sorting by a column in
+    `SORT_FIELDS` and searching Data object names (shown in the
+    `NAME_COLUMN`) are passed to it and done by the server.
+
+    While no sorting or search is applied, rows of the cached listing set
+    with `set_listing` are shown first and paging continues after them;
+    fetched pages are added to the listing.
+    """
+
+    #: Selected row changed
+    selectionChanged = Signal()
+    #: A page could not be fetched from the server
+    fetchFailed = Signal()
+    #: Search term changed
+    searchChanged = Signal(str)
 
-    def __init__(self, data_objects, descriptor_schema, *args, **kwargs):
+    def __init__(self, fetch_page, descriptor_schema, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.ow = kwargs.get('parent', None)
 
-        self._data_objects = data_objects
+        self.fetch_page = fetch_page
         self.descriptor_schema = descriptor_schema
         self.header_schema = None
         self.header = None
+        self.target_column = None
+        self.ordering = None    # type: Optional[str]
+        self.search = ''
+        self.listing = None     # type: Optional[DataListing]
 
         # set layout
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
 
+        self.search_edit = QLineEdit(placeholderText='Search by file name...')
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.__schedule_search)
+        self.__search_timer = QTimer(self, singleShot=True, interval=SEARCH_DELAY)
+        self.__search_timer.timeout.connect(self.__apply_search)
+
         self.view = QTreeView()
         self.view.setSortingEnabled(False)
         self.view.setAlternatingRowColors(True)
         self.view.setEditTriggers(QTreeView.NoEditTriggers)
         self.view.setSelectionMode(QTreeView.SingleSelection)
+        self.view.setUniformRowHeights(True)
 
-        self.model = QStandardItemModel()
-        self.display_data_objects()
-
-        self.layout().addWidget(self.view)
+        # sorting is done on the server, the view only shows the indicator
+        header_view = self.view.header()
+        header_view.setSectionsClickable(True)
+        header_view.setSortIndicatorShown(False)
+        header_view.sectionClicked.connect(self.__sort_by_column)
 
-    def __set_header_values(self):
-        if self.header_schema:
-            labels = [val.get('label', '?') for val in self.header_schema]
-            self.model.setHorizontalHeaderLabels(labels)
+        self.model = None  # type: Optional[DataObjectsModel]
+        self.__parse_description_schema()
+        self.reset()
 
-    def __create_row(self, obj):
-        row_items = []
-        tabular_data = obj.descriptor.get('tabular', None)
-        output_data = obj.output.get('table', None)
+        self.layout().addWidget(self.search_edit)
+        self.layout().addWidget(self.view)
 
-        # TODO: refactor this. Use file_name and size from obj.output instead of desc. schema
-        for schema_value in self.header_schema:
-            item = QStandardItem()
-            schema_key = schema_value['name']
-            data_info = tabular_data.get(schema_key, '?') if tabular_data else '?'
+    def __schedule_search(self):
+        # restart the timer on every keystroke
+        self.__search_timer.start()
 
-            if schema_key == 'file_name' and data_info == '?':
-                data_info = output_data.get('file', '?') if output_data else '?'
-            elif schema_key == 'file_size' and data_info == '?':
-                data_info = output_data.get('size', '?') if output_data else '?'
+    def __apply_search(self):
+        search = self.search_edit.text().strip()
+        if search != self.search:
+            self.search = search
+            self.reset()
+            self.searchChanged.emit(search)
 
-            item.setData(data_info, Qt.DisplayRole)
-            row_items.append(item)
+    def __sort_by_column(self, column):
+        header_view = self.view.header()
+        field = SORT_FIELDS.get(self.header_schema[column].get('name'))
+        if field is None:
+            # restore the indicator of the current ordering
+            header_view.setSortIndicatorShown(self.ordering is not None)
+            return
 
-        return row_items
+        descending = self.ordering == field
+        self.ordering = '-' + field if descending else field
+        header_view.setSortIndicatorShown(True)
+        header_view.setSortIndicator(column, Qt.DescendingOrder if descending else Qt.AscendingOrder)
+        self.reset()
 
-    def __populate_data_model(self):
-        if self.model:
-            self.model.clear()
-            for data_object in self.data_objects:
-                self.model.appendRow(self.__create_row(data_object))
+    def set_descriptor_schema(self, descriptor_schema):
+        self.descriptor_schema = descriptor_schema
+        self.__parse_description_schema()
+        self.reset()
 
     def __parse_description_schema(self):
-        self.header_schema = []
-
-        if self.descriptor_schema:
-            for schema_value in self.descriptor_schema.schema:
-                if schema_value['name'] == 'tabular':
-                    [self.header_schema.append(value) for value in schema_value['group']]
+        self.header_schema = header_schema(self.descriptor_schema)
 
         if self.header_schema:
             keys = [val.get('name', '?') for val in self.header_schema]
             header_index = namedtuple('header_index', [label for label in keys])
             self.header = header_index(*[index for index, _ in enumerate(keys)])
 
-    @property
-    def data_objects(self):
-        return self._data_objects
+    def reset(self):
+        """ Drop loaded rows and start over. """
+        fetch_page = partial(self.fetch_page, ordering=self.ordering or DEFAULT_ORDERING,
+                             search=self.search or None)
+        if self.listing is not None and not self.ordering and not self.search:
+            self.model = DataObjectsModel(self.header_schema, fetch_page,
+                                          cached_rows=self.listing.rows(),
+                                          complete=self.listing.complete)
+            self.model.pageFetched.connect(self.__add_to_listing)
+        else:
+            self.model = DataObjectsModel(self.header_schema, fetch_page)
+        self.model.fetchFailed.connect(self.fetchFailed)
+        self.model.target_column = self.target_column
 
-    @data_objects.setter
-    def data_objects(self, data_objects):
-        self._data_objects = data_objects
-        self.display_data_objects()
-
-    def display_data_objects(self):
-        self.__parse_description_schema()
-        self.__populate_data_model()
-        self.__set_header_values()
+        # replacing the model replaces the selection model as well
+        selection_model = self.view.selectionModel()
         self.view.setModel(self.model)
+        if selection_model is not None:
+            selection_model.deleteLater()
+        self.view.selectionModel().selectionChanged.connect(self.selectionChanged)
 
-    def set_target_column(self, target_column):
-        # type: (int) -> None
+    def __add_to_listing(self, offset, data_objects):
+        self.listing.add_page(offset, data_objects,
+                              complete=len(data_objects) < self.model.page_size)
 
-        for row in range(self.model.rowCount()):
-            item = self.model.item(row, target_column)
-            item_data = item.data(role=Qt.DisplayRole)
-            if item_data:
-                item.setIcon(variable_icon(item_data))
+    def set_listing(self, listing):
+        # type: (DataListing) -> None
+        selected = self.selected_data_id()
+        self.listing = listing
+        self.reset()
 
-    def selected_data_object(self):
-        # type: () -> Data
+        # keep the selection if the object is still listed
+        row = self.model.data_row(selected) if selected is not None else None
+        if row is not None:
+            self.view.selectionModel().blockSignals(True)
+            self.view.setCurrentIndex(self.model.index(row, 0))
+            self.view.selectionModel().blockSignals(False)
+
+    def set_target_column(self, target_column):
+        # type: (Optional[int]) -> None
+        self.target_column = target_column
+        self.model.target_column = target_column
+
+    def selected_row(self):
+        # type: () -> Optional[int]
+        if self.view.selectionModel() is None:
+            return None
         rows = self.view.selectionModel().selectedRows()
         assert 0 <= len(rows) <= 1
-        sel_row_index = rows[0].row() if rows else None
+        return rows[0].row() if rows else None
 
-        obj_range = range(len(self._data_objects))
-        assert sel_row_index in obj_range
-
-        try:
-            return self._data_objects[sel_row_index]
-        except IndexError:
-            # can this happen? self._data_objects can't
-            # be empty if model is constructed
-            pass
+    def selected_data_id(self):
+        # type: () -> Optional[int]
+        row = self.selected_row()
+        return self.model.data_id(row) if row is not None else None
@@ -0,0 +1,333 @@
+""" Shared status polling for running Resolwe processes """
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+from typing import Callable, Dict, Optional
+
+from resdk.resources.data import Data
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+log = logging.getLogger(__name__)
+
+
+#: Data object statuses that mark a finished process
+FINISHED_STATUSES = ('OK', 'ER')
+
+#: Polling interval bounds (seconds)
+MIN_INTERVAL = 0.5
+MAX_INTERVAL = 10.0
+
+#: Multiplicative backoff factor and relative jitter
+BACKOFF = 1.5
+JITTER = 0.25
+
+#: Seconds between checks of a waiter's `cancelled` event
+CANCEL_CHECK = 0.5
+
+#: Delay bounds (seconds) before reconnecting to an unreachable notification server
+MIN_RECONNECT = 5.0
+MAX_RECONNECT = 300.0
+
+
+class _Waiter:
+    def __init__(self, data_object):
+        # type: (Data) -> None
+        self.data_object = data_object
+        self.event = threading.Event()
+        self.count = 1
+        #: incremented whenever a polling round finds the object changed
+        self.version = 0
+
+
+class NotificationChannel:
+    """ Websocket subscription to Resolwe's data change notifications.
+
+    The server pushes a message to ``<url>/<subscriber id>`` whenever an
+    observed Data object changes. Objects are observed by listing them
+    with the ``observe`` query parameter set to the subscriber id.
+    """
+
+    #: Seconds to wait for the connection before falling back to polling
+    CONNECT_TIMEOUT = 2
+
+    def __init__(self, res, url, on_change):
+        self.res = res
+        self.subscriber_id = str(uuid.uuid4())
+        self.url = '{}/{}'.format(url.rstrip('/'), self.subscriber_id)
+        self.on_change = on_change
+        self.connected = threading.Event()
+
+        cookie = None
+        auth = getattr(res, 'auth', None)
+        if getattr(auth, 'sessionid', None):
+            cookie = 'csrftoken={}; sessionid={}'.format(auth.csrftoken, auth.sessionid)
+
+        self._app = websocket.WebSocketApp(
+            self.url, cookie=cookie,
+            on_open=self._on_open, on_message=self._on_message,
+            on_error=self._on_close, on_close=self._on_close)
+        self._thread = threading.Thread(
+            target=self._app.run_forever, name='resolwe-notifications', daemon=True)
+        self._thread.start()
+        self.connected.wait(self.CONNECT_TIMEOUT)
+
+    def _on_open(self, *_):
+        self.connected.set()
+
+    def _on_close(self, *_):
+        self.connected.clear()
+
+    def _on_message(self, _, message):
+        try:
+            item = json.loads(message).get('item') or {}
+        except (ValueError, AttributeError):
+            item = {}
+        self.on_change(item.get('id'))
+
+    def observe(self, data_ids):
+        # type: (list) -> None
+        """ Subscribe to changes of Data objects with `data_ids`. """
+        self.res.api.data.get(id__in=','.join(str(data_id) for data_id in data_ids),
+                              observe=self.subscriber_id)
+
+    def close(self):
+        self._app.close()
+
+
+class StatusScheduler:
+    """ Poll status of all outstanding Data objects in a single thread.
+
+    Instead of querying every running Data object on its own, objects
+    are registered with the scheduler and checked with one filtered list
+    query per polling round. Polling interval grows exponentially (with
+    jitter) while nothing changes and is reset whenever a new object is
+    registered or a process finishes.
+
+    If a :class:`NotificationChannel` is attached, notifications start
+    the next round immediately and polling is only kept at the maximal
+    interval as a safety net.
+    """
+
+    def __init__(self, res):
+        self.res = res
+        self.channel = None  # type: Optional[NotificationChannel]
+        self._connecting = None  # type: Optional[threading.Thread]
+        self._reconnect_delay = MIN_RECONNECT
+        self._reconnect_at = 0.
+        self._channel_disabled = False
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._changed = threading.Condition(self._lock)
+        self._waiters = {}  # type: Dict[int, _Waiter]
+        self._interval = MIN_INTERVAL
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='resolwe-status', daemon=True)
+            self._thread.start()
+
+    def _next_interval(self):
+        if self.connected:
+            return MAX_INTERVAL
+
+        interval = self._interval
+        self._interval = min(self._interval * BACKOFF, MAX_INTERVAL)
+        return interval * (1 + random.uniform(-JITTER, JITTER))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self._thread = None
+                    return
+                data_ids = list(self._waiters.keys())
+
+            try:
+                polled = self._poll(data_ids)
+            except Exception:
+                # keep polling, server might be temporarily unavailable
+                polled = {}
+
+            with self._lock:
+                finished = False
+                for data_id, data_object in polled.items():
+                    waiter = self._waiters.get(data_id)
+                    if waiter is None:
+                        continue
+                    done = data_object.status in FINISHED_STATUSES
+                    if done or data_object.modified != waiter.data_object.modified:
+                        # progress, outputs or status changed
+                        waiter.data_object._update_fields(data_object._original_values)
+                        waiter.version += 1
+                    if done:
+                        del self._waiters[data_id]
+                        waiter.event.set()
+                        finished = True
+                self._changed.notify_all()
+
+                if finished:
+                    self._interval = MIN_INTERVAL
+
+                if self._waiters:
+                    self._wakeup.wait(self._next_interval())
+
+    def _poll(self, data_ids):
+        # type: (list) -> Dict[int, Data]
+        query = self.res.data.filter(id__in=','.join(str(data_id) for data_id in data_ids))
+        return {data_object.id: data_object for data_object in query}
+
+    @property
+    def connected(self):
+        # type: () -> bool
+        return self.channel is not None and self.channel.connected.is_set()
+
+    def connect_notifications(self, url):
+        # type: (str) -> Optional[threading.Thread]
+        """ Attach a notification channel at websocket `url` in the background.
+
+        Return the connecting thread, or None if already connected, still
+        connecting or websocket-client is not installed. Polling continues
+        as usual if the server can not be reached; a failed connection is
+        retried only after an exponentially growing delay.
+        """
+        if websocket is None:
+            if not self._channel_disabled:
+                self._channel_disabled = True
+                log.warning('websocket-client is not installed, '
+                            'notifications from %s are disabled', url)
+            return None
+        if self.connected:
+            return None
+
+        with self._lock:
+            if self._connecting is not None or time.monotonic() < self._reconnect_at:
+                return None
+            self._connecting = threading.Thread(
+                target=self._connect, args=(url,), name='resolwe-connect', daemon=True)
+            self._connecting.start()
+            return self._connecting
+
+    def _connect(self, url):
+        try:
+            channel = NotificationChannel(self.res, url, lambda _: self.wake())
+        except Exception:
+            channel = None
+
+        if channel is not None and not channel.connected.is_set():
+            channel.close()
+            channel = None
+
+        with self._lock:
+            self._connecting = None
+            if channel is None:
+                self._reconnect_at = time.monotonic() + self._reconnect_delay
+                self._reconnect_delay = min(self._reconnect_delay * 2, MAX_RECONNECT)
+                return
+            self._reconnect_delay = MIN_RECONNECT
+            self.channel = channel
+            data_ids = list(self._waiters.keys())
+
+        # objects registered while connecting
+        if data_ids:
+            self._observe(data_ids)
+        self.wake()
+
+    def _observe(self, data_ids):
+        try:
+            self.channel.observe(data_ids)
+        except Exception:
+            pass
+
+    def wake(self):
+        """ Start next polling round immediately. """
+        with self._lock:
+            self._interval = MIN_INTERVAL
+            self._wakeup.notify_all()
+
+    def wait(self, data_object, timeout=None, on_update=None, cancelled=None):
+        # type: (Data, Optional[float], Optional[Callable[[Data], None]], Optional[threading.Event]) -> bool
+        """ Block until `data_object` is finished.
+
+        Fields of `data_object` are updated in place. While the process
+        runs, `on_update(data_object)` is called in the caller's thread
+        whenever a polling round finds the object changed. Return False if
+        the object did not finish in `timeout` seconds or the `cancelled`
+        event was set.
+        """
+        if data_object.status in FINISHED_STATUSES:
+            return True
+
+        # observe before the first poll, so no change can slip in between
+        observed = self.connected
+        if observed:
+            self._observe([data_object.id])
+
+        with self._lock:
+            waiter = self._waiters.get(data_object.id)
+            if waiter is None:
+                waiter = self._waiters[data_object.id] = _Waiter(data_object)
+            else:
+                waiter.count += 1
+            seen = waiter.version
+            self._interval = MIN_INTERVAL
+            self._wakeup.notify_all()
+            self._ensure_thread()
+
+        if not observed and self.connected:
+            # channel connected in the meantime
+            self._observe([data_object.id])
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        finished = False
+        try:
+            while True:
+                step = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if cancelled is not None:
+                    step = CANCEL_CHECK if step is None else min(step, CANCEL_CHECK)
+
+                with self._lock:
+                    if not waiter.event.is_set() and waiter.version == seen:
+                        self._changed.wait(step)
+                    finished = waiter.event.is_set()
+                    version = waiter.version
+
+                if finished:
+                    break
+                if version != seen:
+                    seen = version
+                    if on_update is not None:
+                        self._update(data_object, waiter)
+                        try:
+                            on_update(data_object)
+                        except Exception:
+                            # e.g. a failed snapshot download, the next change is reported again
+                            log.exception('Update of Data %s failed', data_object.id)
+                if cancelled is not None and cancelled.is_set():
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        finally:
+            with self._lock:
+                waiter.count -= 1
+                if not finished and not waiter.count:
+                    self._waiters.pop(data_object.id, None)
+
+        if finished:
+            self._update(data_object, waiter)
+        return finished
+
+    @staticmethod
+    def _update(data_object, waiter):
+        if waiter.data_object is not data_object:
+            data_object._update_fields(waiter.data_object._original_values)
@@ -0,0 +1,79 @@
+""" Compact encoding of point selections sent as process inputs """
+import base64
+import zlib
+
+import numpy as np
+
+from typing import Sequence
+
+
+#: Encodings: run lengths of alternating unselected/selected points, or a bit mask
+RLE, BITSET = 'rle', 'bits'
+
+
+def selection_mask(indices, n):
+    # type: (Sequence[int], int) -> np.ndarray
+    mask = np.zeros(n, dtype=bool)
+    mask[np.asarray(indices, dtype=int)] = True
+    return mask
+
+
+def _pack(array):
+    # type: (np.ndarray) -> str
+    return base64.b64encode(zlib.compress(array.tobytes())).decode('ascii')
+
+
+def _unpack(data, dtype):
+    # type: (str, ...) -> np.ndarray
+    return np.frombuffer(zlib.decompress(base64.b64decode(data)), dtype=dtype)
+
+
+def run_lengths(mask):
+    # type: (np.ndarray) -> np.ndarray
+    """ Run lengths of `mask`, starting with a (possibly empty) unselected run. """
+    changes = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    runs = np.diff(np.r_[0, changes, len(mask)])
+    if len(mask) and mask[0]:
+        runs = np.r_[0, runs]
+    return runs.astype('<u4')
+
+
+def encode_rle(mask):
+    # type: (np.ndarray) -> str
+    return '{}:{}'.format(RLE, _pack(run_lengths(mask)))
+
+
+def encode_bitset(mask):
+    # type: (np.ndarray) -> str
+    return '{}:{}:{}'.format(BITSET, len(mask), _pack(np.packbits(mask)))
+
+
+def encode_selection(indices, n):
+    # type: (Sequence[int], int) -> str
+    """ Encode selected `indices` of `n` points as runs or as a bit mask.
+
+    Selections with few runs (lasso or rectangle over neighbouring points)
+    are smaller as run lengths, scattered ones as a bit mask. Either is
+    deflated and base64 encoded into a short ASCII string.
+    """
+    mask = selection_mask(indices, n)
+    runs = run_lengths(mask)
+    if runs.nbytes < (n + 7) // 8:
+        return '{}:{}'.format(RLE, _pack(runs))
+    return encode_bitset(mask)
+
+
+def decode_selection(encoded):
+    # type: (str) -> np.ndarray
+    """ Return selected indices of a selection encoded by `encode_selection`. """
+    encoding, _, data = encoded.partition(':')
+    if encoding == RLE:
+        runs = _unpack(data, '<u4').astype(int)
+        # odd runs are selected
+        mask = np.repeat(np.arange(len(runs)) % 2 == 1, runs)
+    elif encoding == BITSET:
+        n, _, data = data.partition(':')
+        mask = np.unpackbits(_unpack(data, np.uint8))[:int(n)].astype(bool)
+    else:
+        raise ValueError('Unknown selection encoding {!r}'.format(encoding))
+    return np.flatnonzero(mask)
@@ -0,0 +1,85 @@
+""" Process-wide registry of authenticated Resolwe connections """
+import threading
+
+from typing import Dict, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+from resdk.resolwe import Resolwe
+
+from orangecontrib.resolwe.utils.scheduler import StatusScheduler
+
+
+#: Maximal number of kept-alive connections to the server per session
+POOL_SIZE = 8
+
+
+class ResolweSession:
+    """ Lazily authenticated Resolwe client shared by widgets and worker threads.
+
+    Login is performed on first access of :attr:`res`. All requests made
+    through the client's API reuse a bounded pool of keep-alive
+    connections.
+    """
+
+    def __init__(self, url, username, password, pool_size=POOL_SIZE):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._res = None        # type: Optional[Resolwe]
+        self._scheduler = None  # type: Optional[StatusScheduler]
+
+    @property
+    def res(self):
+        # type: () -> Resolwe
+        with self._lock:
+            if self._res is None:
+                res = Resolwe(self.username, self.password, self.url)
+                self._mount_pool(self.http_session(res))
+                self._res = res
+            return self._res
+
+    @staticmethod
+    def http_session(res):
+        """ Return `requests.Session` used by the client's API. """
+        return res.api._store['session']
+
+    def _mount_pool(self, http_session):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+        http_session.mount('http://', adapter)
+        http_session.mount('https://', adapter)
+
+    @property
+    def logged_in(self):
+        # type: () -> bool
+        return self._res is not None
+
+    def scheduler(self, notifications_url=None):
+        # type: (Optional[str]) -> StatusScheduler
+        res = self.res
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = StatusScheduler(res)
+            scheduler = self._scheduler
+
+        if notifications_url:
+            # returns at once, connects (or backs off) in the background
+            scheduler.connect_notifications(notifications_url)
+        return scheduler
+
+
+_sessions = {}  # type: Dict[Tuple[str, str], ResolweSession]
+_sessions_lock = threading.Lock()
+
+
+def get_session(url, username, password):
+    # type: (str, str, str) -> ResolweSession
+    """ Return the session shared by all users of `url` logged in as `username`. """
+    key = (url, username)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None or session.password != password:
+            session = _sessions[key] = ResolweSession(url, username, password)
+        return session
@@ -0,0 +1,54 @@
+""" Spatial index of embedded points """
+import numpy as np
+
+
+class GridIndex:
+    """ Uniform grid over 2D points for fast rectangle queries.
+
+    Points are sorted by grid cell, so points of a row of cells are
+    a contiguous slice of `order`.
+    """
+
+    def __init__(self, x, y, cells=256):
+        # type: (np.ndarray, np.ndarray, int) -> None
+        self.x, self.y = x, y
+        self.cells = cells
+        finite = np.isfinite(x) & np.isfinite(y)
+        if np.any(finite):
+            self.x_min, self.x_max = x[finite].min(), x[finite].max()
+            self.y_min, self.y_max = y[finite].min(), y[finite].max()
+        else:
+            self.x_min = self.x_max = self.y_min = self.y_max = 0.
+
+        cell = self._cell_y(y) * cells + self._cell_x(x)
+        cell[~finite] = 0
+        self.order = np.argsort(cell, kind='mergesort')
+        self.starts = np.searchsorted(cell[self.order], np.arange(cells * cells + 1))
+
+    def _cell(self, values, low, high):
+        scale = self.cells / (high - low) if high > low else 0
+        # clip to the grid first, huge values would overflow in the conversion to int
+        values = np.clip(np.nan_to_num(np.asarray(values, dtype=float)), low, high)
+        return np.minimum(((values - low) * scale).astype(int), self.cells - 1)
+
+    def _cell_x(self, x):
+        return self._cell(x, self.x_min, self.x_max)
+
+    def _cell_y(self, y):
+        return self._cell(y, self.y_min, self.y_max)
+
+    def query(self, x0, x1, y0, y1):
+        # type: (float, float, float, float) -> np.ndarray
+        """ Indices of points inside the rectangle. """
+        if x1 < self.x_min or x0 > self.x_max or y1 < self.y_min or y0 > self.y_max:
+            return np.array([], dtype=int)
+
+        cx0, cx1 = self._cell_x([x0, x1])
+        cy0, cy1 = self._cell_y([y0, y1])
+        rows = [self.order[self.starts[cy * self.cells + cx0]:self.starts[cy * self.cells + cx1 + 1]]
+                for cy in range(cy0, cy1 + 1)]
+        candidates = np.concatenate(rows)
+
+        # border cells are only partly inside
+        x, y = self.x[candidates], self.y[candidates]
+        return candidates[(x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)]
@@ -0,0 +1,134 @@
+""" Load Orange tables directly from streamed HTTP responses """
+import bz2
+import csv
+import gzip
+import io
+import lzma
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from concurrent.futures import CancelledError
+from typing import Callable, Iterable, Iterator, Optional
+
+from Orange.data import Table
+from Orange.data.io import TabReader
+
+
+CHUNK_SIZE = 1024 * 1024
+
+DECOMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+PICKLE_EXTENSIONS = ('.pickle', '.pkl')
+TAB_EXTENSIONS = ('.tab', '.tsv')
+
+
+class ChunkedReader(io.RawIOBase):
+    """ Read-only file object over an iterable of byte chunks.
+
+    `callback` is called with the percentage of `total_size` read so far.
+    """
+
+    def __init__(self, chunks, total_size=None, callback=None):
+        # type: (Iterable[bytes], Optional[int], Optional[Callable[[float], None]]) -> None
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self.total_size = total_size
+        self.bytes_read = 0
+        self.callback = callback
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        self.bytes_read += size
+        if self.callback is not None and self.total_size:
+            self.callback(min(100 * self.bytes_read / self.total_size, 100))
+        return size
+
+
+def interruptible(chunks, cancelled):
+    # type: (Iterable[bytes], threading.Event) -> Iterator[bytes]
+    """ Pass `chunks` through, raise CancelledError once `cancelled` is set. """
+    for chunk in chunks:
+        if cancelled.is_set():
+            raise CancelledError
+        yield chunk
+
+
+def counted(chunks, callback):
+    # type: (Iterable[bytes], Callable[[int], None]) -> Iterator[bytes]
+    """ Pass `chunks` through, report the size of each to `callback`. """
+    for chunk in chunks:
+        callback(len(chunk))
+        yield chunk
+
+
+def read_npy(buffer):
+    # type: (bytes) -> np.ndarray
+    """ Read-only array over the contents of an .npy file, without copying. """
+    f = io.BytesIO(buffer)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        f.seek(0)
+        return np.load(f)
+
+    count = int(np.prod(shape, dtype=np.int64))
+    array = np.frombuffer(buffer, dtype=dtype, count=count, offset=f.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def split_extension(file_name):
+    # type: (str) -> (str, str)
+    """ Return (format extension, compression extension) of `file_name`. """
+    base, ext = os.path.splitext(file_name.lower())
+    if ext in DECOMPRESSORS:
+        return os.path.splitext(base)[1], ext
+    return ext, ''
+
+
+def can_stream(file_name):
+    # type: (str) -> bool
+    ext, _ = split_extension(file_name)
+    return ext in PICKLE_EXTENSIONS + TAB_EXTENSIONS
+
+
+def read_table(fileobj, file_name):
+    # type: (io.RawIOBase, str) -> Table
+    """ Read a Table in the format given by `file_name` from `fileobj`. """
+    ext, compression = split_extension(file_name)
+    stream = io.BufferedReader(fileobj, CHUNK_SIZE)
+    if compression:
+        stream = DECOMPRESSORS[compression](stream)
+
+    if ext in PICKLE_EXTENSIONS:
+        table = pickle.load(stream)
+    elif ext in TAB_EXTENSIONS:
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        table = TabReader.data_table(csv.reader(text, delimiter='\t'))
+    else:
+        raise ValueError('Can not stream {}'.format(file_name))
+
+    table.name = os.path.basename(file_name).split('.')[0]
+    return table
@@ -0,0 +1,253 @@
+""" Preparing data tables for transfer to the server """
+import base64
+import bz2
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import pickle
+import threading
+import time
+import uuid
+
+from concurrent.futures import CancelledError
+from functools import partial
+from typing import Optional
+from urllib.parse import urljoin
+
+import numpy as np
+import requests
+import scipy.sparse as sp
+
+from Orange.data import Table
+
+
+#: Dense X with a smaller share of non-zero values is sent as CSR matrix
+SPARSE_DENSITY = 0.3
+
+
+def density(X):
+    # type: (...) -> float
+    if X.size == 0:
+        return 1.
+    if sp.issparse(X):
+        return X.nnz / (X.shape[0] * X.shape[1])
+    return np.count_nonzero(X) / X.size
+
+
+def sparsify(table, max_density=SPARSE_DENSITY):
+    # type: (Table, float) -> Table
+    """ Return `table` with X in CSR format if it is sparse enough.
+
+    Count matrices of single cell data are mostly zeros; stored as CSR
+    they pickle to a fraction of the dense size and are unpickled as
+    sparse tables on the other side.
+    """
+    if sp.isspmatrix_csr(table.X):
+        return table
+    if not sp.issparse(table.X) and density(table.X) > max_density:
+        return table
+
+    sparse_table = table.copy()
+    sparse_table.X = sp.csr_matrix(table.X)
+    return sparse_table
+
+
+#: Transfer formats readable by Orange on the server: (file extension, opener).
+#: Gzip headers get a fixed mtime, so saving the same table gives the same
+#: bytes and an interrupted upload can be resumed.
+FORMATS = {
+    'pickle': ('.pickle', open),
+    'gzip': ('.pickle.gz', partial(gzip.GzipFile, compresslevel=6, mtime=0)),
+    'gzip-fast': ('.pickle.gz', partial(gzip.GzipFile, compresslevel=1, mtime=0)),
+    'bz2': ('.pickle.bz2', bz2.open),
+    'xz': ('.pickle.xz', lzma.open),
+}
+
+#: Tables estimated below this size are sent uncompressed
+COMPRESS_SIZE = 1024 ** 2
+#: Tables estimated above this size are compressed with the fastest level
+FAST_COMPRESS_SIZE = 64 * 1024 ** 2
+
+
+def estimate_size(table):
+    # type: (Table) -> int
+    """ Rough size of the pickled `table` in bytes. """
+    def nbytes(array):
+        if sp.issparse(array):
+            array = array.tocsr()
+            return array.data.nbytes + array.indices.nbytes + array.indptr.nbytes
+        if array.dtype == object:
+            # strings and other python objects, assume short values
+            return array.size * 16
+        return array.nbytes
+
+    return sum(nbytes(array) for array in (table.X, table.Y, table.metas, table.W))
+
+
+def choose_format(table, compress=False):
+    # type: (Table, bool) -> str
+    """ Pick a transfer format for `table` by its estimated size.
+
+    Compressed pickles can only be read by servers with Orange that
+    supports them (PickleReader with SUPPORT_COMPRESSED), so tables are
+    sent as plain pickles unless `compress` is set. Small tables are not
+    worth compressing; large ones are compressed with the fastest gzip
+    level, where compression time would otherwise exceed the time saved
+    on the wire.
+    """
+    size = estimate_size(table)
+    if not compress or size < COMPRESS_SIZE:
+        return 'pickle'
+    if size < FAST_COMPRESS_SIZE:
+        return 'gzip'
+    return 'gzip-fast'
+
+
+def save_table(table, directory, transfer_format=None, name=None):
+    # type: (Table, str, Optional[str], Optional[str]) -> str
+    """ Save `table` to `directory` for upload and return the file path.
+
+    The file is named `name` (default: table name) with the extension of
+    the transfer format.
+    """
+    transfer_format = transfer_format or choose_format(table)
+    extension, opener = FORMATS[transfer_format]
+
+    # TODO: What to do if Table is not named?
+    file_path = os.path.join(directory, (name or table.name) + extension)
+    with opener(file_path, 'wb') as f:
+        pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return file_path
+
+
+#: Size of a single upload request
+UPLOAD_CHUNK_SIZE = 8 * 1024 ** 2
+#: Attempts per chunk before the upload is given up (and can be resumed)
+UPLOAD_RETRIES = 5
+
+
+class UploadError(Exception):
+    pass
+
+
+def is_transient(status_code):
+    # type: (int) -> bool
+    """ Can a request that failed with `status_code` succeed when repeated. """
+    return status_code >= 500
+
+
+class ChunkedUpload:
+    """ Upload a file to the server's upload endpoint in chunks.
+
+    Progress is stored after every acknowledged chunk together with the
+    chunk's MD5 checksum. If the upload fails, uploading the same file
+    again resumes after the last chunk whose checksum still matches the
+    local file, under the same upload id.
+    """
+
+    def __init__(self, url, http_session, file_path, state_dir,
+                 chunk_size=UPLOAD_CHUNK_SIZE, progress_callback=None):
+        self.url = url
+        self.http_session = http_session
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.file_size = os.path.getsize(file_path)
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+
+        key = '|'.join((url, self.file_name, str(self.file_size), str(chunk_size)))
+        self.state_path = os.path.join(
+            state_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    def _chunks(self):
+        with open(self.file_path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    @staticmethod
+    def _checksum(chunk):
+        # type: (bytes) -> str
+        return base64.b64encode(hashlib.md5(chunk).digest()).decode('ascii')
+
+    def checksums(self):
+        # type: () -> list
+        """ MD5 checksums of the file's chunks, as stored in the upload state. """
+        return [self._checksum(chunk) for chunk in self._chunks()]
+
+    def _post_chunk(self, state, chunk_number, chunk, checksum):
+        for attempt in range(UPLOAD_RETRIES):
+            try:
+                response = self.http_session.post(
+                    urljoin(self.url, 'upload/'),
+                    files={'file': (self.file_name, chunk)},
+                    data={'_chunkSize': self.chunk_size,
+                          '_totalSize': self.file_size,
+                          '_chunkNumber': chunk_number,
+                          '_currentChunkSize': len(chunk)},
+                    headers={'Session-Id': state['session_id'],
+                             'X-File-Uid': state['file_uid'],
+                             'Content-MD5': checksum})
+                if response.status_code in (200, 201):
+                    return response
+                if not is_transient(response.status_code):
+                    # e.g. not authorized or file too large, repeating does not help
+                    raise UploadError('Upload of {} was rejected at chunk {} (HTTP {})'.format(
+                        self.file_name, chunk_number, response.status_code))
+            except requests.ConnectionError:
+                pass
+            if attempt < UPLOAD_RETRIES - 1:
+                time.sleep(min(2 ** attempt, 30))
+
+        raise UploadError('Upload of {} failed at chunk {}'.format(self.file_name, chunk_number))
+
+    def run(self, cancelled=None):
+        # type: (Optional[threading.Event]) -> dict
+        """ Upload the file and return the value for a `basic:file:` input. """
+        state = self._load_state() or {}
+        if not state.get('file_uid'):
+            state = {'session_id': str(uuid.uuid4()), 'file_uid': str(uuid.uuid4()),
+                     'checksums': [], 'temp': None}
+
+        acknowledged = state['checksums']
+        state['checksums'] = []
+        response = None
+        for chunk_number, chunk in enumerate(self._chunks()):
+            if cancelled is not None and cancelled.is_set():
+                raise CancelledError
+
+            checksum = self._checksum(chunk)
+            resume = chunk_number < len(acknowledged) and acknowledged[chunk_number] == checksum
+            if not resume:
+                # chunks after a changed one must be sent again
+                acknowledged = []
+                response = self._post_chunk(state, chunk_number, chunk, checksum)
+                state['temp'] = response.json()['files'][0]['temp']
+
+            state['checksums'].append(checksum)
+            self._save_state(state)
+
+            if self.progress_callback is not None and self.file_size:
+                uploaded = min((chunk_number + 1) * self.chunk_size, self.file_size)
+                self.progress_callback(100 * uploaded / self.file_size)
+
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return {'file': self.file_name, 'file_temp': state['temp']}
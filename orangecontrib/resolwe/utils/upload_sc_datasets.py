@@ -1,4 +1,5 @@
 import os
+import tempfile
 import urllib.request
 import json
 
@@ -7,6 +8,8 @@ from concurrent.futures import ThreadPoolExecutor
 from resdk import Resolwe
 from Orange.data.table import Table
 
+from orangecontrib.resolwe.utils.transfer import save_table, sparsify
+
 URL_REMOTE = 'http://datasets.orange.biolab.si/sc/'
 SC_FILES = [
     # ('DC_expMatrix_DCnMono.tab.gz', '9606'),
@@ -48,21 +51,21 @@ def upload(filename):
         annotations['other']['instances'] = data['instances']
         annotations['other']['variables'] = data['variables']
 
-    data = Table(os.path.join(URL_REMOTE, filename))
-
-    if '.tab.gz' in filename:
-        filename = filename.replace('.tab.gz', '.pickle')
+    data = sparsify(Table(os.path.join(URL_REMOTE, filename)))
 
-    data.save(filename)
+    # uploads run concurrently, each saves into its own directory
+    with tempfile.TemporaryDirectory() as temp_dir:
+        name = filename.replace('.tab.gz', '').replace('.pickle', '')
+        file_path = save_table(data, temp_dir, name=name)
 
-    dataset = res.run(
-        'data-table-upload',
-        input={'src': filename}
-    )
+        dataset = res.run(
+            'data-table-upload',
+            input={'src': file_path}
+        )
 
-    # dataset = res.data.get(id=1)
-    annotations['tabular']['file_name'] = filename
-    annotations['tabular']['file_size'] = os.stat(filename).st_size
+        # dataset = res.data.get(id=1)
+        annotations['tabular']['file_name'] = os.path.basename(file_path)
+        annotations['tabular']['file_size'] = os.stat(file_path).st_size
 
     # descriptor schema slug
     dataset.descriptor_schema = 'data_info'
@@ -70,9 +73,6 @@ def upload(filename):
     dataset.descriptor = annotations
     dataset.save()
 
-    # cleanup
-    os.remove(filename)
-
 
 if __name__ == '__main__':
     res = Resolwe('admin', 'admin123', 'http://127.0.0.1:8000/')
@@ -18,7 +18,7 @@ from AnyQt.QtWidgets import (
 
 from Orange.data import Table
 from Orange.widgets import widget, gui, settings
-from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher
+from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher, methodinvoke
 from orangecontrib.resolwe.utils import ResolweHelper, ResolweTask
 
 
@@ -31,6 +31,7 @@ class OWResolweDataObject(widget.OWWidget):
     want_main_area = False
 
     auto_commit = settings.Setting(True)
+    memory_map = settings.Setting(False)
 
     class Inputs:
         data = widget.Input("Data", resolwe.Data)
@@ -58,6 +59,12 @@ class OWResolweDataObject(widget.OWWidget):
         self._usr_perm = QLabel(box)
         box.layout().addWidget(self._usr_perm)
 
+        box = gui.widgetBox(self.controlArea, 'Options')
+        gui.checkBox(box, self, 'memory_map', 'Memory-map cached table',
+                     callback=self._memory_map_changed,
+                     tooltip='Keep the table arrays on disk and load them on demand. '
+                             'Saves memory for large tables, but the arrays are read-only.')
+
         self.controlArea.setMinimumWidth(self.controlArea.sizeHint().width())
         self.layout().setSizeConstraint(QLayout.SetFixedSize)
 
@@ -119,6 +126,10 @@ class OWResolweDataObject(widget.OWWidget):
         self.__setup_proces_info()
         self.__setup_usr_permissions()
 
+    def _memory_map_changed(self):
+        # looked up at call time, auto_commit wraps commit after the checkbox is created
+        self.commit()
+
     def commit(self):
         if not self.data_table_object:
             self.Outputs.data.send(None)
@@ -131,13 +142,28 @@ class OWResolweDataObject(widget.OWWidget):
         assert self._task is None
 
         self.progressBarInit()
-        func = partial(self.res.download_data_table, self.data_table_object)
-
+        progress = methodinvoke(self, "_set_progress", (float,))
         self._task = ResolweTask('download')
+        func = partial(self.res.download_data_table, self.data_table_object,
+                       progress_callback=progress, mmap=self.memory_map,
+                       cancelled=self._task.interrupt)
         self._task.future = self._executor.submit(func)
         self._task.watcher = FutureWatcher(self._task.future)
         self._task.watcher.done.connect(self.task_finished)
 
+    @Slot(float)
+    def _set_progress(self, value):
+        self.progressBarSet(value)
+
+    def cancel(self):
+        if self._task is not None:
+            # stops a running download between chunks
+            self._task.interrupt.set()
+            self._task.future.cancel()
+            self._task.watcher.done.disconnect(self.task_finished)
+            self._task = None
+            self.progressBarFinished()
+
     @Slot(Future, name='Future')
     def task_finished(self, future):
         assert threading.current_thread() == threading.main_thread()
@@ -1,18 +1,24 @@
 """ OWResolweDataSets """
 import os
 import sys
+import threading
 
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from typing import Deque, Dict, List, Optional
 
 from AnyQt.QtWidgets import QLabel,QApplication
-from AnyQt.QtCore import QSize
+from AnyQt.QtCore import QSize, pyqtSlot as Slot
 
 from Orange.data import Table
 from Orange.widgets import widget, settings, gui
 from Orange.widgets.utils.signals import Output, Input
 from Orange.widgets.widget import Msg
 from Orange.widgets.data.owdatasets import SizeDelegate, NumericalDelegate
+from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher, methodinvoke
 
-from orangecontrib.resolwe.utils import ResolweHelper
+from orangecontrib.resolwe.utils import ResolweHelper, ResolweTask
 from orangecontrib.resolwe.utils.gui import ResolweDataWidget
 
 from resdk.resources.data import Data
@@ -25,12 +31,16 @@ class OWResolweDataSets(widget.OWWidget):
     priority = 30
 
     auto_commit = settings.Setting(True)
+    prefetch = settings.Setting(False)
+    #: Megabytes that speculative prefetching of neighbouring rows may download per selection
+    prefetch_budget = settings.Setting(200)
 
     DATA_TYPE = 'singlecell'
     DESCRIPTOR_SCHEMA = 'data_info'
 
     class Error(widget.OWWidget.Error):
         no_remote_datasets = Msg("Could not fetch dataset list")
+        upload_failed = Msg("Upload failed\n{}")
 
     class Warning(widget.OWWidget.Warning):
         only_local_datasets = Msg("pass")
@@ -39,7 +49,10 @@ class OWResolweDataSets(widget.OWWidget):
         data_object = Output("Data Object", Data)
 
     class Inputs:
-        data_table = Input("Data", Table)
+        data_table = Input("Data", Table, multiple=True)
+
+    #: Number of tables uploaded at the same time, others wait in a queue
+    MAX_CONCURRENT_UPLOADS = 2
 
     def __init__(self):
         super().__init__()
@@ -47,28 +60,70 @@ class OWResolweDataSets(widget.OWWidget):
         self.info_label = QLabel()
         info_box.layout().addWidget(self.info_label)
 
-        self.res = ResolweHelper()
-        data_objects = self.res.list_data_objects(self.DATA_TYPE)
-        descriptor_schema = self.res.get_descriptor_schema(self.DESCRIPTOR_SCHEMA)
+        # threading
+        self._uploads = []              # type: List[ResolweTask]
+        self._upload_queue = deque()    # type: Deque[Table]
+        self._upload_progress = {}      # type: Dict[ResolweTask, float]
+        self._refresh = None            # type: Optional[ResolweTask]
+        self._refresh_pending = False
+        self._executor = ThreadExecutor()
 
-        self.res_widget = ResolweDataWidget(data_objects, descriptor_schema)
-        self.res_widget.view.selectionModel().selectionChanged.connect(self.commit)
-        self.res_widget.set_target_column(self.res_widget.header.target)
+        self._selection = None          # type: Optional[ResolweTask]
+        self._count = None              # type: Optional[ResolweTask]
+        self.matching_count = None      # type: Optional[int]
+        self._prefetch = None           # type: Optional[ResolweTask]
 
-        self.__assign_delegates()
+        self.res = ResolweHelper()
+        # rows from the previous session, brought up to date in the background;
+        # further rows are paged in from the server
+        self.listing = self.res.data_listing(self.DATA_TYPE)
+        self.data_objects_count = self.listing.count if self.listing.descriptor_schema else None
+
+        self.res_widget = ResolweDataWidget(self.fetch_page, None)
+        self.res_widget.selectionChanged.connect(self.commit)
+        self.res_widget.selectionChanged.connect(self.run_prefetch)
+        self.res_widget.fetchFailed.connect(self.Error.no_remote_datasets)
+        self.res_widget.searchChanged.connect(self.run_count)
+        if self.listing.descriptor_schema is not None:
+            self.set_descriptor_schema(self.listing.descriptor_schema)
+        self.res_widget.set_listing(self.listing)
 
         self.udpdate_info_box()
 
         self.mainArea.layout().addWidget(self.res_widget)
 
+        upload_box = gui.widgetBox(self.controlArea, "Upload")
+        self.upload_label = QLabel()
+        upload_box.layout().addWidget(self.upload_label)
+        self.cancel_button = gui.button(upload_box, self, "Cancel", callback=self.cancel)
+        self._update_upload_info()
+
+        box = gui.widgetBox(self.controlArea, 'Options')
+        gui.checkBox(box, self, 'prefetch', 'Prefetch selected dataset',
+                     callback=self.run_prefetch,
+                     tooltip='Download the selected dataset into the local cache '
+                             'before it is requested downstream.')
+        gui.spin(box, self, 'prefetch_budget', 0, 10000, step=50,
+                 label='Neighbours budget (MB):',
+                 tooltip='Datasets next to the selected one are prefetched '
+                         'until this much data is downloaded.')
+
         self.controlArea.layout().addStretch(10)
 
         gui.auto_commit(self.controlArea, self, "auto_commit", "&Commit")
 
+        self.run_refresh()
+
         print(os.environ.get('RESOLWE_HOST_URL'))
         print(os.environ.get('RESOLWE_API_USERNAME'))
         print(os.environ.get('RESOLWE_API_PASSWORD'))
 
+    def set_descriptor_schema(self, descriptor_schema):
+        self.res_widget.set_descriptor_schema(descriptor_schema)
+        if self.res_widget.header is not None:
+            self.res_widget.set_target_column(self.res_widget.header.target)
+            self.__assign_delegates()
+
     def __assign_delegates(self):
         self.res_widget.view.setItemDelegateForColumn(
             self.res_widget.header.file_size, SizeDelegate(self))
@@ -80,21 +135,252 @@ class OWResolweDataSets(widget.OWWidget):
             self.res_widget.header.genes, NumericalDelegate(self)
         )
 
+    def fetch_page(self, offset, limit, ordering=None, search=None):
+        # type: (...) -> Future
+        """ Request a page of Data objects in a worker thread. """
+        return self._executor.submit(partial(
+            self.res.list_data_objects, self.DATA_TYPE, offset=offset, limit=limit,
+            ordering=ordering, search=search))
+
     def udpdate_info_box(self):
-        if self.res_widget.data_objects:
-            self.info_label.setText('Data objects on server: {}'.format(len(self.res_widget.data_objects)))
+        if self.data_objects_count is None:
+            self.info_label.setText('Connecting to server...')
+            return
+
+        text = 'Data objects on server: {}'.format(self.data_objects_count)
+        if self.res_widget.search:
+            text += '\nMatching search: {}'.format(
+                '...' if self.matching_count is None else self.matching_count)
+        self.info_label.setText(text)
+
+    def run_count(self):
+        """ Count Data objects matching the search term in the background. """
+        if self._count is not None:
+            self._count.watcher.done.disconnect(self.task_finished)
+            self._count.future.cancel()
+            self._count = None
+
+        self.matching_count = None
+        search = self.res_widget.search
+        if search:
+            self._count = ResolweTask('count')
+            self._count.future = self._executor.submit(
+                self.res.count_data_objects, self.DATA_TYPE, search)
+            self._count.watcher = FutureWatcher(self._count.future)
+            self._count.watcher.done.connect(self.task_finished)
+        self.udpdate_info_box()
 
     @Inputs.data_table
-    def handle_input(self, data):
-        # upload file
-        self.res.upload_data_table(data)
-        # fetch data object and reconstruct data model
-        self.res_widget.data_objects = self.res.list_data_objects(self.DATA_TYPE)
+    def handle_input(self, data, _id):
+        if data is not None:
+            self._upload_queue.append(data)
+            self._start_uploads()
+
+    def cancel_prefetch(self):
+        if self._prefetch is not None:
+            self._prefetch.interrupt.set()
+            self._prefetch.future.cancel()
+            self._prefetch.watcher.done.disconnect(self.task_finished)
+            self._prefetch = None
+
+    def run_prefetch(self):
+        self.cancel_prefetch()
+        row = self.res_widget.selected_row()
+        if not self.prefetch or row is None:
+            return
+
+        model = self.res_widget.model
+        header = self.res_widget.header
+        neighbours = []
+        for neighbour in (row + 1, row - 1):
+            if 0 <= neighbour < model.rowCount():
+                size = model.value(neighbour, header.file_size)
+                if isinstance(size, int):
+                    neighbours.append((model.data_id(neighbour), size))
+
+        self._prefetch = ResolweTask('prefetch')
+        budget = self.prefetch_budget * 1024 ** 2
+        self._prefetch.future = self._executor.submit(
+            self._prefetch_tables, model.data_id(row), neighbours, budget, self._prefetch.interrupt)
+        self._prefetch.watcher = FutureWatcher(self._prefetch.future)
+        self._prefetch.watcher.done.connect(self.task_finished)
+
+    def _prefetch_tables(self, data_id, neighbours, budget, cancelled):
+        self.res.prefetch_data_table(data_id, cancelled)
+
+        # speculative downloads, counted against the budget of this selection
+        # as they arrive, so a table larger than its listed size counts in full
+        prefetched = 0
+
+        def count(n_bytes):
+            nonlocal prefetched
+            prefetched += n_bytes
+
+        for data_id, size in neighbours:
+            if prefetched + size <= budget:
+                self.res.prefetch_data_table(data_id, cancelled, count)
+
+    def _start_uploads(self):
+        while self._upload_queue and len(self._uploads) < self.MAX_CONCURRENT_UPLOADS:
+            self.run_upload(self._upload_queue.popleft())
+        self._update_upload_info()
+
+    def cancel(self):
+        """Cancel all uploads and drop the queued tables."""
+        self._upload_queue.clear()
+        for task in list(self._uploads):
+            task.interrupt.set()
+            task.future.cancel()
+            # disconnect the `task_finished` slot
+            task.watcher.done.disconnect(self.task_finished)
+            self._uploads.remove(task)
+        self._upload_progress.clear()
+        self.progressBarFinished()
+        self._update_upload_info()
+
+    def run_upload(self, data):
+        if not self._uploads:
+            self.Error.upload_failed.clear()
+            self.progressBarInit()
+
+        task = ResolweTask('upload')
+        progress = methodinvoke(self, "_set_upload_progress", (object, float))
+        func = partial(self.res.upload_data_table, data,
+                       progress_callback=partial(progress, task),
+                       cancelled=task.interrupt)
+
+        task.future = self._executor.submit(func)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.task_finished)
+        self._uploads.append(task)
+        self._upload_progress[task] = 0
+
+    def run_refresh(self):
+        # coalesce refresh requests while one is running
+        if self._refresh is not None:
+            self._refresh_pending = True
+            return
+
+        self._refresh_pending = False
+        self._refresh = ResolweTask('refresh')
+        self._refresh.future = self._executor.submit(
+            self.res.update_listing, self.listing, self.DATA_TYPE, self.DESCRIPTOR_SCHEMA)
+        self._refresh.watcher = FutureWatcher(self._refresh.future)
+        self._refresh.watcher.done.connect(self.task_finished)
+
+    @Slot(object, float)
+    def _set_upload_progress(self, task, value):
+        if task in self._upload_progress:
+            self._upload_progress[task] = value
+            self._update_upload_progress()
+
+    def _update_upload_progress(self):
+        # queued uploads count as not started
+        total = len(self._upload_progress) + len(self._upload_queue)
+        if total:
+            self.progressBarSet(sum(self._upload_progress.values()) / total)
+
+    def _update_upload_info(self):
+        running, queued = len(self._uploads), len(self._upload_queue)
+        if running or queued:
+            self.upload_label.setText('Uploading {} table(s), {} queued'.format(running, queued))
+        else:
+            self.upload_label.setText('No uploads in progress')
+        self.cancel_button.setEnabled(bool(running or queued))
+
+    @Slot(Future, name='Future')
+    def task_finished(self, future):
+        assert threading.current_thread() == threading.main_thread()
+        assert future.done()
+
+        if self._refresh is not None and self._refresh.future is future:
+            self._refresh = None
+            try:
+                self.data_objects_count = future.result()
+            except Exception:
+                self.Error.no_remote_datasets()
+            else:
+                self.Error.no_remote_datasets.clear()
+                if self.res_widget.descriptor_schema is None:
+                    self.set_descriptor_schema(self.listing.descriptor_schema)
+                # reconstruct data model
+                self.res_widget.set_listing(self.listing)
+                if self.res_widget.search:
+                    self.run_count()
+                self.udpdate_info_box()
+            if self._refresh_pending:
+                self.run_refresh()
+            return
+
+        if self._count is not None and self._count.future is future:
+            self._count = None
+            try:
+                self.matching_count = future.result()
+            except Exception:
+                self.Error.no_remote_datasets()
+            self.udpdate_info_box()
+            return
+
+        if self._prefetch is not None and self._prefetch.future is future:
+            self._prefetch = None
+            try:
+                future.result()
+            except Exception:
+                # prefetching is best effort, the table is downloaded on request
+                pass
+            return
+
+        if self._selection is not None and self._selection.future is future:
+            self._selection = None
+            try:
+                self.Outputs.data_object.send(future.result())
+            except Exception:
+                self.Error.no_remote_datasets()
+            return
+
+        task = next(task for task in self._uploads if task.future is future)
+        self._uploads.remove(task)
+        self._upload_progress.pop(task, None)
+
+        try:
+            future.result()
+        except Exception as ex:
+            self.Error.upload_failed(str(ex))
+        else:
+            # fetch new data object
+            self.run_refresh()
+
+        self._start_uploads()
+        if self._uploads:
+            self._update_upload_progress()
+        else:
+            self._upload_progress.clear()
+            self.progressBarFinished()
+
+    def onDeleteWidget(self):
+        self.cancel()
+        self.cancel_prefetch()
+        # keep rows paged in during this session
+        self.listing.save()
+        self._executor.shutdown(wait=False)
+        super().onDeleteWidget()
 
     def commit(self):
-        sel_data_obj = self.res_widget.selected_data_object()
-        assert isinstance(sel_data_obj, Data)
-        self.Outputs.data_object.send(sel_data_obj)
+        if self._selection is not None:
+            self._selection.watcher.done.disconnect(self.task_finished)
+            self._selection.future.cancel()
+            self._selection = None
+
+        data_id = self.res_widget.selected_data_id()
+        if data_id is None:
+            self.Outputs.data_object.send(None)
+            return
+
+        # the model keeps ids only, fetch the selected Data object
+        self._selection = ResolweTask('select')
+        self._selection.future = self._executor.submit(partial(self.res.get_object, id=data_id))
+        self._selection.watcher = FutureWatcher(self._selection.future)
+        self._selection.watcher.done.connect(self.task_finished)
 
     def sizeHint(self):
         return QSize(900, 600)
@@ -3,14 +3,18 @@ import os.path
 import re
 import sys
 import threading
+import itertools
+import multiprocessing
 import numpy as np
+import pyqtgraph as pg
 
+from xml.sax.saxutils import escape
 from joblib.memory import Memory
-from typing import Optional, Sequence, Tuple, Dict
+from typing import Optional, Sequence, Tuple, Dict, List
 
-from AnyQt.QtWidgets import QFormLayout, QApplication
+from AnyQt.QtWidgets import QFormLayout, QApplication, QToolTip
 from AnyQt.QtGui import QPainter
-from AnyQt.QtCore import Qt, pyqtSignal as Signal, pyqtSlot as Slot
+from AnyQt.QtCore import Qt, QRectF, QTimer, pyqtSignal as Signal, pyqtSlot as Slot
 
 import Orange.data
 from Orange.data import Domain, Table, ContinuousVariable, DiscreteVariable
@@ -30,20 +34,40 @@ from Orange.widgets.utils.annotated_data import (
     create_annotated_table, create_groups_table, ANNOTATED_DATA_SIGNAL_NAME)
 
 
-from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher
+from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher, methodinvoke
 from functools import partial
 from concurrent.futures import Future, CancelledError
 from resdk import resolwe
-from orangecontrib.resolwe.utils import ResolweHelper, ResolweTask
+from orangecontrib.resolwe.utils import ProcessError, ProcessTimeout, ResolweHelper, ResolweTask
+from orangecontrib.resolwe.utils.embedding import (
+    LocalEmbedding, PCACache, class_var_info, prefer_local, tsne
+)
+from orangecontrib.resolwe.utils.selection import encode_selection
+from orangecontrib.resolwe.utils.spatial import GridIndex
 
 
 class MDSInteractiveViewBox(InteractiveViewBox):
     def _dragtip_pos(self):
         return 10, 10
 
+    def mouseClickEvent(self, ev):
+        # points do not take clicks themselves, see OWMDSGraph.update_data
+        if ev.button() == Qt.LeftButton:
+            ev.accept()
+            self.graph.select_at(self.mapSceneToView(ev.scenePos()))
+        else:
+            super().mouseClickEvent(ev)
+
 
 class OWMDSGraph(OWScatterPlotGraph):
     jitter_size = settings.Setting(0)
+    #: more visible points than this are drawn as a density image
+    lod_threshold = settings.Setting(20000)
+
+    #: resolution of the density image (pixels along the longer side)
+    DENSITY_BINS = 256
+    #: milliseconds to wait for panning or zooming to settle
+    LOD_DELAY = 50
 
     def __init__(self, scatter_widget, parent=None, name="None", view_box=None):
         super().__init__(scatter_widget, parent=parent, _=name,
@@ -51,13 +75,221 @@ class OWMDSGraph(OWScatterPlotGraph):
         for axis_loc in ["left", "bottom"]:
             self.plot_widget.hideAxis(axis_loc)
 
+        self._grid = None           # type: Optional[GridIndex]
+        #: drawn points (None if all are drawn)
+        self._visible = None        # type: Optional[np.ndarray]
+        self._density_item = None   # type: Optional[pg.ImageItem]
+
+        # point sizes, colors and symbols: {name: (key, value)}
+        self._memo = {}             # type: Dict[str, Tuple[tuple, object]]
+        self._lod_timer = QTimer(self.plot_widget, singleShot=True, interval=self.LOD_DELAY)
+        self._lod_timer.timeout.connect(self.update_lod)
+        self.plot_widget.getViewBox().sigRangeChanged.connect(self._lod_timer.start)
+
+    def new_data(self, *args, **kwargs):
+        self._memo.clear()
+        super().new_data(*args, **kwargs)
+
+    def rescale_data(self):
+        self._memo.clear()
+        super().rescale_data()
+
+    def set_palette(self, p):
+        self._memo.pop('colors', None)
+        super().set_palette(p)
+
+    def _memoized(self, name, key, compute):
+        """ Return the cached value of `compute()`, recomputed when `key` changes.
+
+        Cache is cleared with new data; view-only updates (jitter, density,
+        zoom) reuse the arrays.
+        """
+        cached = self._memo.get(name)
+        if cached is None or cached[0] != key:
+            cached = self._memo[name] = (key, compute())
+        return cached[1]
+
     def update_data(self, attr_x, attr_y, reset_view=True):
         super().update_data(attr_x, attr_y, reset_view=reset_view)
         for axis in ["left", "bottom"]:
             self.plot_widget.hideAxis(axis)
         self.plot_widget.setAspectLocked(True, 1)
 
+        # the plot was cleared together with the density image
+        self._density_item = None
+        self._grid = None
+        self._visible = None
+        if getattr(self, 'scatterplot_item', None) is not None:
+            x, y = self.scatterplot_item.getData()
+            self._grid = GridIndex(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+            # pyqtgraph hit-tests clicks on every point, disabled items pass them
+            # to the view box, which looks them up in the grid
+            for item in self._point_items():
+                item.setEnabled(False)
+        self.update_lod()
+
+    def _point_items(self):
+        # the selection outlines are drawn under the points, as a second scatter plot
+        return [item for item in (self.scatterplot_item, self.scatterplot_item_sel)
+                if item is not None]
+
+    def _set_points_visible(self, visible):
+        self._visible = visible
+        for item in self._point_items():
+            if hasattr(item, 'setPointsVisible'):
+                item.setPointsVisible(True if visible is None else visible)
+
+    def update_lod(self):
+        """ Draw visible points, or their density if there are too many. """
+        scatterplot_item = getattr(self, 'scatterplot_item', None)
+        if scatterplot_item is None or scatterplot_item.scene() is None:
+            return
+
+        if self._grid is None or len(self._grid.x) <= self.lod_threshold:
+            # small data, all points are drawn
+            self._show_density(None)
+            self._set_points_visible(None)
+            self.plot_widget.setRenderHint(QPainter.Antialiasing, True)
+            return
+
+        (x0, x1), (y0, y1) = self.plot_widget.getViewBox().viewRange()
+        visible = self._grid.query(x0, x1, y0, y1)
+
+        mask = np.zeros(len(self._grid.x), dtype=bool)
+        if len(visible) > self.lod_threshold:
+            self._show_density(visible, QRectF(x0, y0, x1 - x0, y1 - y0))
+        else:
+            self._show_density(None)
+            mask[visible] = True
+        self._set_points_visible(mask)
+        self.plot_widget.setRenderHint(QPainter.Antialiasing, len(visible) <= self.lod_threshold)
+
+    def _show_density(self, visible, rect=None):
+        if visible is None:
+            if self._density_item is not None:
+                self._density_item.hide()
+            for item in self._point_items():
+                item.show()
+            return
+
+        aspect = rect.height() / rect.width() if rect.width() else 1
+        bins = (self.DENSITY_BINS, max(int(self.DENSITY_BINS * aspect), 1)) if aspect <= 1 else \
+            (max(int(self.DENSITY_BINS / aspect), 1), self.DENSITY_BINS)
+        counts, _, _ = np.histogram2d(
+            self._grid.x[visible], self._grid.y[visible], bins=bins,
+            range=[[rect.left(), rect.right()], [rect.top(), rect.bottom()]])
+        image = np.log1p(counts)
+
+        if self._density_item is None:
+            self._density_item = pg.ImageItem()
+            lut = np.c_[np.full((256, 3), (40, 80, 160)), np.arange(256)].astype(np.uint8)
+            self._density_item.setLookupTable(lut)
+            self.plot_widget.addItem(self._density_item)
+        self._density_item.setImage(image, levels=(0, max(image.max(), 1)))
+        self._density_item.setRect(rect)
+        self._density_item.show()
+        for item in self._point_items():
+            item.hide()
+
+    def points_at(self, pos):
+        # type: (...) -> np.ndarray
+        """ Indices (into the drawn points) of drawn points under `pos` in data coordinates. """
+        if self._grid is None or not len(self._grid.x):
+            return np.array([], dtype=int)
+
+        # point sizes are in pixels
+        sx, sy = self.view_box.viewPixelSize()
+        sizes = np.asarray(self.compute_sizes(), dtype=float)
+        radius = np.nanmax(sizes) / 2
+        x, y = pos.x(), pos.y()
+        candidates = self._grid.query(x - radius * sx, x + radius * sx,
+                                      y - radius * sy, y + radius * sy)
+        if self._visible is not None:
+            candidates = candidates[self._visible[candidates]]
+        distance = np.hypot((self._grid.x[candidates] - x) / sx,
+                            (self._grid.y[candidates] - y) / sy)
+        return candidates[distance <= sizes[candidates] / 2]
+
+    def select_at(self, pos):
+        points = self.points_at(pos)
+        if len(points):
+            self.select_indices(self.data_indices[points])
+        else:
+            self.unselect_all()
+
+    def select_by_rectangle(self, value_rect):
+        if self._grid is None:
+            return
+        rect = value_rect.normalized()
+        points = self._grid.query(rect.left(), rect.right(), rect.top(), rect.bottom())
+        self.select_indices(self.data_indices[points])
+
+    def select(self, points):
+        self.select_indices([point.data() for point in points])
+
+    def select_indices(self, indices):
+        """ Select data rows `indices`, like `select`, with the same modifiers. """
+        if self.data is None:
+            return
+        if self.selection is None:
+            self.selection = np.zeros(len(self.data), dtype=np.uint8)
+        keys = QApplication.keyboardModifiers()
+        # Remove from selection
+        if keys & Qt.AltModifier:
+            self.selection[indices] = 0
+        # Append to the last group
+        elif keys & Qt.ShiftModifier and keys & Qt.ControlModifier:
+            self.selection[indices] = np.max(self.selection)
+        # Create a new group
+        elif keys & Qt.ShiftModifier:
+            self.selection[indices] = np.max(self.selection) + 1
+        # No modifiers: new selection
+        else:
+            self.selection = np.zeros(len(self.data), dtype=np.uint8)
+            self.selection[indices] = 1
+        self.update_colors(keep_colors=True)
+        if self.label_only_selected:
+            self.update_labels()
+        self.master.selection_changed()
+
+    def help_event(self, event):
+        if self.scatterplot_item is None:
+            return False
+
+        pos = self.scatterplot_item.mapFromScene(event.scenePos())
+        points = self.points_at(pos)
+        if not len(points):
+            return False
+
+        texts = []
+        for index in self.data_indices[points]:
+            text = 'Attributes:\n   {} = {}\n   {} = {}\n'.format(
+                self.shown_x, self.data[index][self.shown_x],
+                self.shown_y, self.data[index][self.shown_y])
+            if self.domain.class_var:
+                text += 'Class:\n   {} = {}\n'.format(
+                    self.domain.class_var.name, self.data[index][self.data.domain.class_var])
+            texts.append(text)
+        text = '<span style="white-space:pre">{}</span>'.format(
+            escape('------------------\n'.join(texts)))
+        QToolTip.showText(event.screenPos(), text, widget=self.plot_widget)
+        return True
+
     def compute_sizes(self):
+        return self._memoized('sizes', (self.attr_size, self.point_width, self.n_points),
+                              self._compute_sizes)
+
+    def compute_colors(self, keep_colors=False):
+        if keep_colors:
+            return super().compute_colors(keep_colors=True)
+        return self._memoized('colors', (self.attr_color, self.alpha_value, self.n_points),
+                              super().compute_colors)
+
+    def compute_symbols(self):
+        return self._memoized('symbols', (self.attr_shape, self.n_points),
+                              super().compute_symbols)
+
+    def _compute_sizes(self):
         def scale(a):
             dmin, dmax = np.nanmin(a), np.nanmax(a)
             if dmax - dmin > 0:
@@ -92,17 +324,33 @@ class OWResolwetSNE(OWWidget):
 
     class Outputs:
         selected_data = Output("Selected Data", resolwe.Data, default=True)
+        selected_table = Output("Selected Table", Table)
 
     settings_version = 2
 
     #: Runtime state
     Running, Finished, Waiting = 1, 2, 3
 
+    #: Where t-SNE runs
+    Automatic, Server, Local = 0, 1, 2
+
     settingsHandler = settings.DomainContextHandler()
 
     max_iter = settings.Setting(300)
     perplexity = settings.Setting(30)
     pca_components = settings.Setting(20)
+    #: minutes to wait for the t-SNE process before detaching from it
+    wait_timeout = settings.Setting(30)
+    #: iterations between intermediate embeddings published by the process (0 disables)
+    snapshot_interval = settings.Setting(50)
+    #: slice the downloaded data table instead of running t-sne-selection
+    local_selection = settings.Setting(True)
+    #: comma separated parameter values of a sweep (empty iterations use max_iter)
+    sweep_perplexities = settings.Setting('10, 30, 50')
+    sweep_iterations = settings.Setting('')
+    backend = settings.Setting(Automatic)
+    #: Run continues from the shown embedding instead of a random one
+    continue_embedding = settings.Setting(False)
 
     # output embedding role.
     NoRole, AttrRole, AddAttrRole, MetaRole = 0, 1, 2, 3
@@ -111,6 +359,9 @@ class OWResolwetSNE(OWWidget):
 
     selection_indices = settings.Setting(None, schema_only=True)
 
+    #: inputs and id of a t-SNE process that was still running when we detached
+    pending_embedding = settings.Setting(None, schema_only=True)
+
     legend_anchor = settings.Setting(((1, 0), (1, 0)))
 
     graph = SettingProvider(OWMDSGraph)
@@ -126,6 +377,12 @@ class OWResolwetSNE(OWWidget):
         out_of_memory = Msg("Out of memory")
         optimization_error = Msg("Error during optimization\n{}")
 
+    class Warning(OWWidget.Warning):
+        still_running = Msg("t-SNE is still running on the server.\n"
+                            "Press Resume to wait for the result.")
+        sweep_incomplete = Msg("{} of the sweep runs did not finish")
+        sweep_parameters = Msg("Sweep parameters must be comma separated numbers")
+
     def __init__(self):
         super().__init__()
         #: Effective data used for plot styling/annotations.
@@ -140,6 +397,15 @@ class OWResolwetSNE(OWWidget):
 
         self._tsne_slug = 't-sne'
         self._tsne_selection_slug = 't-sne-selection'
+        self._pca_slug = 'data-table-pca'
+        #: PCA Data objects by data id: (components, Data)
+        self._pca_objects = {}  # type: Dict[int, Tuple[int, resolwe.Data]]
+        #: local backend
+        self._pca_cache = PCACache()
+        #: idle worker process; a running local job owns its pool until it finishes
+        self._process_pool = None  # type: Optional[multiprocessing.pool.Pool]
+        self._pool_lock = threading.Lock()
+        self._pool_closed = False
         self._embedding_data_object = None
         self._embedding = None
         self._embedding_clas_var = None
@@ -149,6 +415,16 @@ class OWResolwetSNE(OWWidget):
         # threading
         self._task = None  # type: Optional[ResolweTask]
         self._executor = ThreadExecutor()
+        self._progress = methodinvoke(self, "_set_progress", (float,))
+        #: downloads the input table for local selections
+        self._table_task = None  # type: Optional[ResolweTask]
+        self._data_table = None  # type: Optional[Table]
+        self._sweep_result = methodinvoke(self, "_add_result", (object, object))
+        #: finished embeddings by (data id, pca_components, perplexity, iterations)
+        self._results = {}       # type: Dict[tuple, tuple]
+        self._result_keys = []   # type: List[tuple]
+        self.result_index = -1
+        self._snapshot = methodinvoke(self, "_set_snapshot", (object, object))
 
         self.res = ResolweHelper()
 
@@ -182,10 +458,46 @@ class OWResolwetSNE(OWWidget):
             "Perplexity:",
             gui.spin(box, self, "perplexity", 1, 100, step=1))
 
+        form.addRow(
+            "Timeout (min):",
+            gui.spin(box, self, "wait_timeout", 1, 24 * 60, step=5))
+
+        form.addRow(
+            "Preview every:",
+            gui.spin(box, self, "snapshot_interval", 0, 500, step=10,
+                     tooltip="Iterations between intermediate embeddings shown "
+                             "while t-SNE is running (0 disables previews)"))
+
         box.layout().addLayout(form)
 
         gui.separator(box, 10)
-        self.runbutton = gui.button(box, self, "Run", callback=self._run_embeding)
+        self.runbutton = gui.button(box, self, "Run", callback=self._run_clicked)
+
+        gui.checkBox(box, self, "continue_embedding", "Continue from the shown embedding",
+                     tooltip="Run starts from the shown embedding of the same data. "
+                             "Continued embeddings are not stored as results.")
+
+        gui.checkBox(box, self, "local_selection", "Select locally",
+                     callback=self._load_data_table,
+                     tooltip="Select from the input data table if it was downloaded before. "
+                             "The selection is stored on the server only if Selected Data "
+                             "is connected.")
+
+        gui.radioButtons(box, self, "backend", ["Automatic", "Server", "Local"],
+                         label="Run on:", orientation=Qt.Horizontal,
+                         tooltip="Automatic runs small tables, or larger ones while the "
+                                 "server is busy, on this computer")
+
+        box = gui.vBox(self.controlArea, "Parameter Sweep")
+        gui.lineEdit(box, self, "sweep_perplexities", label="Perplexities:",
+                     orientation=Qt.Horizontal)
+        gui.lineEdit(box, self, "sweep_iterations", label="Iterations:",
+                     orientation=Qt.Horizontal,
+                     tooltip="Empty uses Max iterations")
+        self.sweepbutton = gui.button(box, self, "Run Sweep", callback=self._run_sweep)
+        self.result_combo = gui.comboBox(box, self, "result_index", label="Result:",
+                                         orientation=Qt.Horizontal,
+                                         callback=self._result_selected)
 
         box = gui.vBox(self.controlArea, "PCA Preprocessing")
         gui.hSlider(box, self, 'pca_components', label="Components: ",
@@ -213,6 +525,10 @@ class OWResolwetSNE(OWWidget):
                        g.ToolTipShowsAll,
                        g.ClassDensity,
                        g.LabelOnlySelected], box)
+        gui.spin(box, self.graph, "lod_threshold", 1000, 1000000, step=1000,
+                 label="Density above (points):", callback=self.graph.update_lod,
+                 tooltip="Zoomed-out views with more visible points are drawn as a "
+                         "density image; zoom in to see individual points")
 
         self.controlArea.layout().addStretch(100)
         self.icons = gui.attributeIconDict
@@ -257,7 +573,8 @@ class OWResolwetSNE(OWWidget):
             self.update_graph()
 
     def selection_changed(self):
-        if self._task:
+        # only a previous selection job is replaced, embeddings and sweeps keep running
+        if self._task and self._task.slug == self._tsne_selection_slug:
             self.cancel(clear_state=False)
             self._task = None
             self._executor = ThreadExecutor()
@@ -268,25 +585,31 @@ class OWResolwetSNE(OWWidget):
         self.graph.plot_widget.clear()
 
     def _clear_state(self):
+        self._clear_embedding()
+        self._task = None
+        self._executor = ThreadExecutor()
+
+    def _clear_embedding(self):
         self._clear_plot()
         self.graph.new_data(None)
         self._embedding_data_object = None
         self._embedding = None
         self._embedding_clas_var = None
-        self._task = None
-        self._executor = ThreadExecutor()
 
     def cancel(self, clear_state=True):
         """Cancel the current task (if any)."""
 
         if self._task is not None:
+            # stop waiting for the server and ignore the result
+            self._task.interrupt.set()
+            self._task.watcher.finished.disconnect(self.task_finished)
             self._executor.shutdown(wait=False)
             self.runbutton.setText('Run')
             self.progressBarFinished()
             if clear_state:
                 self._clear_state()
 
-    def run_task(self, slug, func):
+    def run_task(self, task, func):
         if self._task is not None:
             try:
                 self.cancel()
@@ -296,7 +619,7 @@ class OWResolwetSNE(OWWidget):
 
         self.progressBarInit()
 
-        self._task = ResolweTask(slug)
+        self._task = task
         self._task.future = self._executor.submit(func)
         self._task.watcher = FutureWatcher(self._task.future)
         self._task.watcher.finished.connect(self.task_finished)
@@ -310,61 +633,414 @@ class OWResolwetSNE(OWWidget):
 
         try:
             future_result = future.result()
+        except CancelledError:
+            pass
         except Exception as ex:
-            # TODO: raise exceptions
-            raise ex
+            self.Error.optimization_error(str(ex))
         else:
-            if self._task.slug == self._tsne_slug:
-                self._embedding_data_object = future_result
-                self._embedding_clas_var = self.res.get_json(self._embedding_data_object, 'class_var')
-                self._embedding = np.array(self.res.get_json(self._embedding_data_object,
-                                                             'embedding_json',
-                                                             'embedding'))
-                self._setup_plot()
+            if isinstance(future_result, LocalEmbedding):
+                self._data_table = future_result.table
+                # local runs ignore `init`, so they are always cached
+                self._embedding_finished((None, future_result.embedding, future_result.class_var),
+                                         warm_start=False)
+
+            elif self._task.slug == self._tsne_slug:
+                if future_result.status not in ('OK', 'ER'):
+                    # keep the server job running and reattach to it later
+                    self.pending_embedding = {'id': future_result.id,
+                                              'inputs': self._embedding_inputs()}
+                    self.Warning.still_running()
+                    return
+                self.pending_embedding = None
+                if future_result.status == 'ER':
+                    self.Error.optimization_error(
+                        '\n'.join(future_result.process_error or []))
+                    return
+
+                embedding, class_var = self._fetch_embedding(future_result)
+                self._embedding_finished((future_result, embedding, class_var),
+                                         warm_start=self._task.warm_start)
+
+            if self._task.slug == 'sweep':
+                if future_result:
+                    self.Warning.sweep_incomplete(future_result)
 
             if self._task.slug == self._tsne_selection_slug:
-                print(future_result)
                 self.Outputs.selected_data.send(future_result)
 
         finally:
             self.progressBarFinished()
-            self.runbutton.setText('Start')
+            self.runbutton.setText('Resume' if self.pending_embedding else 'Run')
+            self.sweepbutton.setText('Run Sweep')
             self._task = None
 
+    def _embedding_finished(self, result, warm_start):
+        if warm_start:
+            # depends on the previous embedding, shown but not reused for the same parameters
+            self._show_result(self._task.key, result)
+        else:
+            self._add_result(self._task.key, result)
+            self._show_result(self._task.key)
+
     @Inputs.data
     def set_data(self, data):
         # type: (Optional[resolwe.Data]) -> None
         if data:
+            self.cancel()
             self.data_table_object = data
+            self._cancel_table_task()
+            self._data_table = None
+            # a new input is embedded from scratch, never from the previous embedding
+            self._clear_embedding()
+            self._update_result_combo()
             self._run_embeding()
 
-    def _run_embeding(self):
+    def _run_clicked(self):
+        self._run_embeding(warm_start=self.continue_embedding)
+
+    def _run_embeding(self, warm_start=False):
         if self._task:
             self.cancel()
             return
 
-        if self._task is None:
+        if self._task is None and self.data_table_object is not None:
+            self.Warning.still_running.clear()
+            self.Error.optimization_error.clear()
+            self.res.set_timeout(self._tsne_slug, self.wait_timeout * 60)
+            # fetched again with the first snapshot of the new run
+            self._embedding_clas_var = None
+
+            # a warm start continues from the shown embedding, so it is never a cached result
+            warm_start = warm_start and self._embedding is not None and \
+                self._embedding_data_object is not None
+            if not warm_start and self._embedding_key() in self._results:
+                # computed before, e.g. in a sweep
+                self._show_result(self._embedding_key())
+                return
+
+            task = ResolweTask(self._tsne_slug)
+            task.key = self._embedding_key()
+            task.warm_start = warm_start
+            pending = self.pending_embedding
+            if pending is not None and pending['inputs'] == self._embedding_inputs():
+                # reattach to the job instead of resubmitting it
+                func = partial(self.res.resume_process,
+                               pending['id'],
+                               self._tsne_slug,
+                               on_update=self._embedding_watcher(bool(self.snapshot_interval)),
+                               cancelled=task.interrupt)
+                self.run_task(task, func)
+                self.runbutton.setText('Stop')
+                return
+
             inputs = {
                 'data_table': self.data_table_object,
                 'pca_components': self.pca_components,
                 'perplexity': self.perplexity,
                 'iterations': self.max_iter
             }
-            if self._embedding is not None and self._embedding_data_object is not None:
+            if warm_start:
                 inputs['init'] = self._embedding_data_object
+            if self.snapshot_interval:
+                inputs['snapshot_interval'] = self.snapshot_interval
 
-            func = partial(self.res.run_process,
-                           self._tsne_slug,
-                           **inputs)
+            func = partial(self._embed, inputs, self.backend, task.interrupt,
+                           self._embedding_watcher(bool(self.snapshot_interval)))
 
             # move filter process in thread
-            self.run_task(self._tsne_slug, func)
+            self.run_task(task, func)
             self.runbutton.setText('Stop')
 
+    def _embedding_key(self, perplexity=None, iterations=None):
+        return (self.data_table_object.id, self.pca_components,
+                perplexity or self.perplexity, iterations or self.max_iter)
+
+    def _sweep_parameters(self):
+        def parse(text, default):
+            values = [int(value) for value in text.replace(',', ' ').split()]
+            return values or [default]
+
+        try:
+            return list(itertools.product(parse(self.sweep_perplexities, self.perplexity),
+                                          parse(self.sweep_iterations, self.max_iter)))
+        except ValueError:
+            return None
+
+    def _run_sweep(self):
+        if self._task:
+            self.cancel(clear_state=False)
+            self._task = None
+            self._executor = ThreadExecutor()
+            return
+
+        self.Warning.sweep_parameters.clear()
+        self.Warning.sweep_incomplete.clear()
+        if self.data_table_object is None:
+            return
+        parameters = self._sweep_parameters()
+        if parameters is None:
+            self.Warning.sweep_parameters()
+            return
+
+        self.res.set_timeout(self._tsne_slug, self.wait_timeout * 60)
+        # inputs and result keys are fixed here, the worker does not read widget state
+        runs = [(self._embedding_key(perplexity, iterations),
+                 {'data_table': self.data_table_object,
+                  'pca_components': self.pca_components,
+                  'perplexity': perplexity,
+                  'iterations': iterations})
+                for perplexity, iterations in parameters]
+        runs = [(key, inputs) for key, inputs in runs if key not in self._results]
+        if not runs:
+            return
+
+        task = ResolweTask('sweep')
+        self.run_task(task, partial(self._sweep, runs, task.interrupt))
+        self.sweepbutton.setText('Stop')
+
+    def _sweep(self, runs, cancelled):
+        # all runs are submitted first and run concurrently on the server
+        started = []
+        for key, inputs in runs:
+            inputs = self._with_pca(inputs, cancelled)
+            data_object = self.res.start_process(self._tsne_slug, **inputs)
+            started.append((key, data_object))
+
+        unfinished = 0
+        timeout = self.res.get_timeout(self._tsne_slug)
+        for i, (key, data_object) in enumerate(started):
+            self.res.wait_process(data_object, timeout=timeout, cancelled=cancelled)
+            if cancelled.is_set():
+                break
+            if data_object.status == 'OK':
+                self._sweep_result(key, (data_object,) + self._fetch_embedding(data_object))
+            else:
+                unfinished += 1
+            self._progress(100 * (i + 1) / len(started))
+        return unfinished
+
+    @Slot(object, object)
+    def _add_result(self, key, result):
+        first = not self._results_for_data()
+        self._results[key] = result
+        self._update_result_combo()
+        if first and self._embedding is None:
+            self._show_result(key)
+
+    def _results_for_data(self):
+        if self.data_table_object is None:
+            return []
+        return sorted(key for key in self._results if key[0] == self.data_table_object.id)
+
+    def _update_result_combo(self):
+        self._result_keys = self._results_for_data()
+        self.result_combo.clear()
+        self.result_combo.addItems(
+            ['perplexity {}, {} iterations, {} PCs'.format(perplexity, iterations, pca_components)
+             for _, pca_components, perplexity, iterations in self._result_keys])
+        current = self._embedding_key() if self.data_table_object is not None else None
+        self.result_index = self._result_keys.index(current) if current in self._result_keys else -1
+
+    def _result_selected(self):
+        if 0 <= self.result_index < len(self._result_keys):
+            self._show_result(self._result_keys[self.result_index])
+
+    def _show_result(self, key, result=None):
+        if result is None:
+            result = self._results[key]
+        self._embedding_data_object, self._embedding, self._embedding_clas_var = result
+        _, self.pca_components, self.perplexity, self.max_iter = key
+        self.result_index = self._result_keys.index(key) if key in self._result_keys else -1
+        self._setup_plot()
+        self._load_data_table()
+
+    def _embed(self, inputs, backend, cancelled, on_update=None):
+        data_table_object = inputs['data_table']
+        local = backend == self.Local
+        if backend == self.Automatic:
+            # decided from the server's metadata, large tables are never downloaded
+            local = prefer_local(data_table_object, self.res.count_queued_processes())
+        if local:
+            table = self.res.download_data_table(data_table_object, cancelled=cancelled)
+            return self._embed_locally(table, inputs, cancelled)
+        return self._start_embedding(inputs, cancelled, on_update)
+
+    def _embed_locally(self, table, inputs, cancelled):
+        data_table_object = inputs['data_table']
+        X = self._pca_cache.get((data_table_object.id, data_table_object.modified),
+                                table.X, inputs['pca_components'])
+
+        # optimization runs in another process, the thread only waits for it
+        pool = self._take_pool()
+        # the pool has a single worker, the optimization itself uses all cores
+        result = pool.apply_async(tsne, (X, inputs['perplexity'], inputs['iterations']),
+                                  {'n_jobs': os.cpu_count()})
+        while not result.ready():
+            if cancelled.is_set():
+                # the worker process is busy with the optimization, stop it
+                pool.terminate()
+                raise CancelledError
+            result.wait(0.5)
+        try:
+            embedding = result.get()
+        finally:
+            self._release_pool(pool)
+        return LocalEmbedding(embedding, class_var_info(table), table)
+
+    def _take_pool(self):
+        with self._pool_lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is None:
+            # a fresh interpreter, forking a process with Qt and worker threads is unsafe
+            pool = multiprocessing.get_context('spawn').Pool(1)
+        return pool
+
+    def _release_pool(self, pool):
+        with self._pool_lock:
+            if self._process_pool is None and not self._pool_closed:
+                self._process_pool, pool = pool, None
+        if pool is not None:
+            pool.terminate()
+
+    def _with_pca(self, inputs, cancelled):
+        """ Add the shared PCA projection to t-SNE `inputs` if the process takes it.
+
+        The projection is computed once per data table, with the largest
+        number of components requested so far; t-SNE truncates it to
+        `pca_components`. Only successful projections are reused.
+        """
+        if 'pca' not in self.res.process_inputs(self._tsne_slug):
+            return inputs
+
+        data_table = inputs['data_table']
+        components = inputs['pca_components']
+        cached = self._pca_objects.get(data_table.id)
+        if cached is None or cached[0] < components:
+            pca = self.res.start_process(self._pca_slug, data_table=data_table,
+                                         components=components)
+            # part of the embedding, limited by the same timeout
+            self.res.wait_process(pca, timeout=self.res.get_timeout(self._tsne_slug),
+                                  cancelled=cancelled)
+            if cancelled.is_set():
+                raise CancelledError
+            if pca.status == 'ER':
+                raise ProcessError(pca)
+            if pca.status != 'OK':
+                raise ProcessTimeout(pca)
+            cached = self._pca_objects[data_table.id] = (components, pca)
+        return dict(inputs, pca=cached[1])
+
+    def _start_embedding(self, inputs, cancelled, on_update=None):
+        if 'snapshot_interval' not in self.res.process_inputs(self._tsne_slug):
+            # older process versions publish the final embedding only
+            inputs = {name: value for name, value in inputs.items()
+                      if name != 'snapshot_interval'}
+        inputs = self._with_pca(inputs, cancelled)
+        data_object = self.res.start_process(self._tsne_slug, **inputs)
+        return self.res.wait_process(data_object,
+                                     timeout=self.res.get_timeout(self._tsne_slug),
+                                     on_update=on_update,
+                                     cancelled=cancelled)
+
+    def _embedding_watcher(self, snapshots):
+        """ Return `on_update` for a running t-SNE job.
+
+        It reports progress and, with `snapshots`, shows intermediate
+        embeddings. A snapshot is downloaded only when it changed since
+        the last one; the class variable only with the first.
+        """
+        state = {'etag': None, 'storage': None, 'class_var': True}
+
+        def on_update(data_object):
+            # called from the worker thread while t-SNE is running
+            self._progress(float(data_object.process_progress or 0))
+
+            output = data_object.output or {}
+            if not snapshots:
+                return
+
+            if output.get('embedding_snapshot_file'):
+                array, state['etag'] = self.res.get_array_if_changed(
+                    data_object, 'embedding_snapshot_file', state['etag'])
+                if array is None:
+                    return
+                embedding, class_var = self._embedding_from_array(
+                    array, output, state['class_var'])
+            elif output.get('embedding_snapshot'):
+                if output['embedding_snapshot'] == state['storage']:
+                    return
+                state['storage'] = output['embedding_snapshot']
+                embedding, class_var = self._fetch_embedding(
+                    data_object, snapshot=True, with_class_var=state['class_var'])
+            else:
+                return
+
+            if class_var is not None:
+                state['class_var'] = False
+            self._snapshot(embedding, class_var)
+
+        return on_update
+
+    @Slot(float)
+    def _set_progress(self, value):
+        self.progressBarSet(value)
+
+    @Slot(object, object)
+    def _set_snapshot(self, embedding, class_var):
+        if self._task is None or self._task.slug != self._tsne_slug:
+            # snapshot of a cancelled run
+            return
+
+        if class_var is not None:
+            self._embedding_clas_var = class_var
+        self._embedding = embedding
+        self._setup_plot()
+
+    def _fetch_embedding(self, data_object, snapshot=False, with_class_var=True):
+        """ Return the embedding and the class variable (as in `class_var` output).
+
+        The binary output is a float32 .npy array with columns x, y and
+        (optionally) the class value index, and needs a single request.
+        Processes that publish JSON only are read from `embedding_json`.
+        """
+        output = data_object.output or {}
+        file_field = 'embedding_snapshot_file' if snapshot else 'embedding_file'
+        if output.get(file_field):
+            array = self.res.get_array(data_object, file_field)
+            return self._embedding_from_array(array, output, with_class_var)
+
+        json_field = 'embedding_snapshot' if snapshot else 'embedding_json'
+        embedding = np.array(self.res.get_json(data_object, json_field, 'embedding'))
+        class_var = None
+        if with_class_var and output.get('class_var'):
+            class_var = self.res.get_json(data_object, 'class_var')
+        return embedding, class_var
+
+    @staticmethod
+    def _embedding_from_array(array, output, with_class_var=True):
+        class_var = None
+        if with_class_var and array.shape[1] > 2 and output.get('class_name'):
+            class_var = {'name': output['class_name'],
+                         'values': output.get('class_values') or [],
+                         'y_data': array[:, 2]}
+        return array[:, :2], class_var
+
+    def _embedding_inputs(self):
+        return {'data_table': self.data_table_object.id,
+                'pca_components': self.pca_components,
+                'perplexity': self.perplexity,
+                'iterations': self.max_iter}
+
     def _setup_plot(self):
-        class_var = DiscreteVariable(self._embedding_clas_var['name'], values=self._embedding_clas_var['values'])
-        y_data = self._embedding_clas_var['y_data']
-        data = np.c_[self._embedding, y_data]
+        if self._embedding_clas_var is not None:
+            class_var = DiscreteVariable(self._embedding_clas_var['name'],
+                                         values=self._embedding_clas_var['values'])
+            y_data = self._embedding_clas_var['y_data']
+            data = np.c_[self._embedding, y_data]
+        else:
+            # intermediate embedding, class is not known yet
+            class_var = None
+            data = self._embedding
 
         plot_data = Table(
             Domain([self.variable_x, self.variable_y], class_vars=class_var), data
@@ -381,24 +1057,121 @@ class OWResolwetSNE(OWWidget):
         self.graph.new_data(plot_data)
         self.graph.update_data(self.variable_x, self.variable_y, True)
 
+    def _load_data_table(self):
+        if not self.local_selection or self.data_table_object is None:
+            return
+        if self._data_table is not None or self._table_task is not None:
+            return
+
+        # only a cached table is used, large tables are not downloaded for selections
+        self._table_task = ResolweTask('download')
+        self._table_task.future = self._executor.submit(
+            self.res.cached_data_table, self.data_table_object)
+        self._table_task.watcher = FutureWatcher(self._table_task.future)
+        self._table_task.watcher.done.connect(self._table_loaded)
+
+    def _cancel_table_task(self):
+        if self._table_task is not None:
+            self._table_task.interrupt.set()
+            self._table_task.future.cancel()
+            self._table_task.watcher.done.disconnect(self._table_loaded)
+            self._table_task = None
+
+    @Slot(Future, name='Future')
+    def _table_loaded(self, future):
+        assert threading.current_thread() == threading.main_thread()
+        assert self._table_task is not None and self._table_task.future is future
+        self._table_task = None
+        try:
+            self._data_table = future.result()
+        except Exception:
+            # selections go through the server
+            self._data_table = None
+
+    def _is_output_linked(self, name):
+        """ Is output `name` connected to a widget in the workflow. """
+        try:
+            scheme = self.signalManager.scheme()
+            node = scheme.widget_manager.node_for_widget(self)
+            return any(link.source_channel.name == name
+                       for link in scheme.find_links(source_node=node))
+        except AttributeError:
+            # not in a workflow, assume it is
+            return True
+
+    def _can_select_locally(self):
+        return self.local_selection and self._data_table is not None and \
+            self._embedding is not None and len(self._data_table) == len(self._embedding)
+
     def commit(self):
         selection = self.graph.get_selection()
-        if self._embedding_data_object is not None and selection is not None:
-            inputs = {'data_table': self.data_table_object,
-                      'embedding': self._embedding_data_object,
-                      'selection': selection.tolist(),
-                      'x_tsne_var': self.variable_x.name,
-                      'y_tsne_var': self.variable_y.name}
+        if self._embedding is None or selection is None:
+            self.Outputs.selected_table.send(None)
+            self.Outputs.selected_data.send(None)
+            return
 
-            func = partial(self.res.run_process,
-                           self._tsne_selection_slug,
-                           **inputs)
+        if self._can_select_locally():
+            self.Outputs.selected_table.send(self._data_table[selection] if len(selection) else None)
+            if not self._is_output_linked(self.Outputs.selected_data.name):
+                # the Data object is created only when something needs it
+                self.Outputs.selected_data.send(None)
+                return
+        else:
+            self.Outputs.selected_table.send(None)
 
-            self.run_task(self._tsne_selection_slug, func)
+        if self._task is not None:
+            # embedding or sweep is running, it takes precedence
+            self.Outputs.selected_data.send(None)
+            return
 
+        if self._embedding_data_object is None:
+            # embedded locally, the server has no embedding to select from
+            if self._can_select_locally() and len(selection):
+                task = ResolweTask(self._tsne_selection_slug)
+                func = partial(self._upload_selection, self._data_table[selection], task.interrupt)
+                self.run_task(task, func)
+            self.Outputs.selected_data.send(None)
+            return
+
+        inputs = {'data_table': self.data_table_object,
+                  'embedding': self._embedding_data_object,
+                  'x_tsne_var': self.variable_x.name,
+                  'y_tsne_var': self.variable_y.name}
+
+        func = partial(self._run_selection, inputs, selection, len(self._embedding))
+        self.run_task(ResolweTask(self._tsne_selection_slug), func)
         self.Outputs.selected_data.send(None)
 
+    def _run_selection(self, inputs, selection, n_points):
+        if 'selection_encoded' in self.res.process_inputs(self._tsne_selection_slug):
+            inputs['selection_encoded'] = encode_selection(selection, n_points)
+        else:
+            # older process versions take a list of indices
+            inputs['selection'] = selection.tolist()
+        return self.res.run_process(self._tsne_selection_slug, **inputs)
+
+    def _upload_selection(self, table, cancelled):
+        """ Upload the selected rows and return the Data object once it is processed. """
+        data_object = self.res.upload_data_table(table, cancelled=cancelled)
+        slug = 'data-table-upload'
+        if not self.res.check_object_status(data_object, timeout=self.res.get_timeout(slug),
+                                            cancelled=cancelled):
+            if cancelled.is_set():
+                raise CancelledError
+            raise ProcessTimeout(data_object)
+        if data_object.status != 'OK':
+            raise ProcessError(data_object)
+        return data_object
+
     def onDeleteWidget(self):
+        self._cancel_table_task()
+        # a running local job terminates its own pool when interrupted
+        self.cancel(clear_state=False)
+        with self._pool_lock:
+            self._pool_closed = True
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.terminate()
         super().onDeleteWidget()
         self._clear_plot()
         self._clear_state()